@@ -1,28 +1,103 @@
 import os
-import textwrap
-
-
-
-os.chdir(os.path.dirname(os.path.realpath(__file__)))
+import random
+import sys
 
+import phone_define_parser
 from phone_define_parser import PhonologyDefinition
-from wordgen import textify
+from wordgen import textify, UnknownLetterError
 from settings import ARGUMENTS
 
-from pyuca.collator import Collator
-c = Collator("pyuca/allkeys.txt")
-sorted_words = sorted(["z","ä","a","á","ê"], key=c.sort_key)
+USAGE = """usage: lexifer [file.def] [-n NUMBER] [-o] [-u] [--stream] [--workers N] [--seed SEED]
+               [--cache DIR] [--profile]
+       lexifer --serve [--cache DIR] [--timeout SECONDS] [--pending N]
+
+  file.def            phonology definition file
+  -n, --number        how many words to generate, default prints a paragraph
+  -o, --one-per-line  print one word per line
+  -u, --unsorted      print words unsorted
+  --stream            write words as they are made, sorting on disk
+  --workers N         generate with this many processes
+  --seed SEED         random seed, for the same words every run
+  --cache DIR         keep built definitions in DIR, to skip parsing next time
+  --profile           afterwards, report where the time went on stderr
+  --serve             answer JSON requests on stdin, one per line (see server.py)
+  --timeout SECONDS   give up on a request taking longer than this, when serving
+  --pending N         turn requests away when this many are waiting, when serving
 
-print(sorted_words)
+Anything not given here comes from settings.py."""
 
+# Where relative definition file names are looked for, if not in the
+# current directory.
+HERE = os.path.dirname(os.path.realpath(__file__))
 
-def main():
-    pd = PhonologyDefinition(file_name = ARGUMENTS.get('filename'))
-    text = generate_words(pd = pd)
-    print_results(text = text)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv:
+        ARGUMENTS.update(parse_arguments(argv))
+    if ARGUMENTS.get('serve'):
+        import server
+        server.serve(find_file, ARGUMENTS.get('cache') or None,
+                     int_argument('pending') or server.MAX_PENDING,
+                     float(ARGUMENTS.get('timeout') or server.TIMEOUT))
+        return
+    if int_argument('seed') is not None:
+        # Seed before parsing: unweighted classes get a little jitter.
+        random.seed(int_argument('seed'))
+    pd = phone_define_parser.load(find_file(ARGUMENTS.get('filename')),
+                                  ARGUMENTS.get('cache') or None, int_argument('seed'))
+    stats = pd.sound_system.enable_stats() if ARGUMENTS.get('profile') else None
+    try:
+        if ARGUMENTS.get('stream') and int_argument('number'):
+            stream_words(pd = pd)
+        else:
+            print_results(text = generate_words(pd = pd))
+    except UnknownLetterError as e:
+        sys.stderr.write("** {}\n".format(e))
+        sys.exit(1)
+    finally:
+        if stats is not None:
+            sys.stderr.write(stats.report() + "\n")
     
 
 
+def parse_arguments(argv:list) -> dict:
+    """Command line options, over the settings in settings.py.
+
+    getopt rather than argparse, which can take longer to import than
+    a short run takes to generate.
+    """
+    import getopt
+    try:
+        options, rest = getopt.gnu_getopt(argv, 'hn:ou', [
+            'help', 'number=', 'one-per-line', 'unsorted', 'stream', 'workers=', 'seed=', 'cache=',
+            'serve', 'timeout=', 'pending=', 'profile'])
+    except getopt.GetoptError as e:
+        sys.stderr.write("** {}\n{}\n".format(e, USAGE))
+        sys.exit(2)
+    arguments = {}
+    for (option, value) in options:
+        if option in ('-h', '--help'):
+            print(USAGE)
+            sys.exit(0)
+        elif option in ('-n', '--number'):
+            arguments['number'] = value
+        elif option in ('-o', '--one-per-line'):
+            arguments['one_per_line'] = 'y'
+        elif option in ('-u', '--unsorted'):
+            arguments['unsorted'] = 'y'
+        else:
+            arguments[option[2:]] = value or 'y'
+    if rest:
+        arguments['filename'] = rest[0]
+    return arguments
+
+def find_file(file_name:str) -> str:
+    if os.path.isabs(file_name) or os.path.exists(file_name):
+        return file_name
+    return os.path.join(HERE, file_name)
+
 def generate_words(pd:PhonologyDefinition) -> str:
     """.
 
@@ -35,15 +110,19 @@ def generate_words(pd:PhonologyDefinition) -> str:
     """
     if not ARGUMENTS.get('number'):
         # Prints out a paragraph of text.
-        return textify(pd.sound_system, 25)
+        return paragraph(pd)
     else:
         # Prints out a list of words.
         try:
             no_of_words = int(ARGUMENTS.get('number'))
         except:
-            return textify(pd.sound_system, 25)
+            return paragraph(pd)
         else:
-            words = pd.generate(no_of_words, ARGUMENTS.get('unsorted'))
+            words = pd.generate(no_of_words, ARGUMENTS.get('unsorted'),
+                                workers=int_argument('workers'),
+                                seed=int_argument('seed'))
+            if len(words) < no_of_words:
+                sys.stderr.write("** Only {} different words could be made.\n".format(len(words)))
             if ARGUMENTS.get('one_per_line'):
                 return '\n'.join([
                     word
@@ -51,7 +130,35 @@ def generate_words(pd:PhonologyDefinition) -> str:
                     if word
                 ])
             else:
-                return textify(pd.sound_system, 25)
+                return paragraph(pd)
+
+def paragraph(pd:PhonologyDefinition) -> str:
+    text = textify(pd.sound_system, 25)
+    if not text:
+        sys.stderr.write("** No words could be made.\n")
+    return text
+
+def stream_words(pd:PhonologyDefinition) -> None:
+    """Write words one per line as they are made, for lists too long
+    to keep in memory: repeats are caught by a Bloom filter, and
+    sorting is done on disk."""
+    from dedup import BloomDedup
+    no_of_words = int_argument('number')
+    words = pd.iter_words(no_of_words, BloomDedup(capacity=no_of_words))
+    if not ARGUMENTS.get('unsorted'):
+        words = pd.iter_sorted(words)
+    utf8stdout = open(1, 'w', encoding='utf-8', closefd=False)
+    made = 0
+    for word in words:
+        print(word, file=utf8stdout)
+        made += 1
+    utf8stdout.flush()
+    if made < no_of_words:
+        sys.stderr.write("** Only {} different words could be made.\n".format(made))
+
+def int_argument(name:str):
+    value = ARGUMENTS.get(name)
+    return int(value) if value else None
 
 def print_results(text:str) -> None:
     # Hack to make print stop whining about encodings.
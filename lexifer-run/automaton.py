@@ -0,0 +1,187 @@
+from collections import deque
+
+
+# Aho-Corasick automaton over a set of literal strings.  Finds
+# whether any of them occurs in a word in a single pass over its
+# characters, however many strings there are -- which is what you
+# want for a few hundred cluster rejections.
+class AhoCorasick:
+    def __init__(self, patterns):
+        self.patterns = sorted(set(patterns))
+        if '' in self.patterns:
+            raise ValueError('Empty pattern in automaton.')
+        # Build the trie.
+        goto = [{}]
+        self.accept = [False]
+        for pat in self.patterns:
+            state = 0
+            for ch in pat:
+                if ch not in goto[state]:
+                    goto.append({})
+                    self.accept.append(False)
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            self.accept[state] = True
+
+        # Failure links, breadth first, then fold them into a full
+        # transition table so stepping is a single dict lookup.
+        # Characters that appear in no pattern always go back to the
+        # start state, so they are left out.
+        fail = [0] * len(goto)
+        self.delta = [None] * len(goto)
+        queue = deque([0])
+        while queue:
+            state = queue.popleft()
+            row = dict(self.delta[fail[state]]) if state else {}
+            for (ch, nxt) in goto[state].items():
+                if state:
+                    fail[nxt] = self.delta[fail[state]].get(ch, 0)
+                self.accept[nxt] = self.accept[nxt] or self.accept[fail[nxt]]
+                row[ch] = nxt
+                queue.append(nxt)
+            self.delta[state] = row
+
+    def __len__(self):
+        return len(self.delta)
+
+    def step(self, state, ch):
+        return self.delta[state].get(ch, 0)
+
+    def advance(self, state, text):
+        """The state after text, or None if a pattern turns up on the way."""
+        delta = self.delta
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if self.accept[state]:
+                return None
+        return state
+
+    def search(self, word):
+        """True if any of the patterns occurs in word."""
+        delta = self.delta
+        accept = self.accept
+        state = 0
+        for ch in word:
+            state = delta[state].get(ch, 0)
+            if accept[state]:
+                return True
+        return False
+
+    def finish(self, state):
+        """Whether a word can end in state.  Always: patterns are
+        found as soon as they are complete."""
+        return True
+
+
+# An AhoCorasick automaton run over words as SoundSystem.assimilate()
+# will leave them, so that rejections can be looked for while a raw
+# word is still being made.  assimilations maps a pair of letters to
+# what the first becomes before the second; metatheses maps a pair of
+# (assimilated) letters that swap places.  A letter is fed on to the
+# automaton once nothing still to come can change it, so a state is
+# the automaton's state together with the letters held back: at most
+# two, and the one before them when it could yet swap with the last
+# letter of the word.  States are numbered as they are found, 0 for
+# the start.
+class AssimilatedAutomaton:
+    def __init__(self, automaton, assimilations, metatheses):
+        self.automaton = automaton
+        # Words are split letter by letter, so only pairs of single
+        # letters ever match.
+        self.assimilations = {(ph1, ph2): new for ((ph1, ph2), new) in assimilations.items()
+                              if len(ph1) == 1 and len(ph2) == 1}
+        self.metatheses = set(metatheses)
+        self.changing = {ph1 for (ph1, ph2) in self.assimilations}
+        self.swapping = {ph1 for (ph1, ph2) in self.metatheses}
+        self.states = [(0, None, ())]
+        self.numbers = {self.states[0]: 0}
+        self.moves = {}
+
+    def __len__(self):
+        return len(self.states)
+
+    def assimilate(self, ph1, ph2):
+        return self.assimilations.get((ph1, ph2), ph1)
+
+    def settle(self, before, held):
+        """The letters of held that nothing to come can change, as
+        assimilation and metathesis will leave them, and what is
+        still held after them.  before is the assimilated letter just
+        before held, if it could swap with a last letter."""
+        out = []
+        while held:
+            ph = held[0]
+            if len(held) >= 2:
+                new = self.assimilate(ph, held[1])
+            elif ph in self.changing:
+                break
+            else:
+                new = ph
+            if new in self.swapping:
+                # It takes the place of the next letter if they swap,
+                # so that has to be known first.
+                if len(held) < 2:
+                    break
+                if len(held) >= 3:
+                    nxt = self.assimilate(held[1], held[2])
+                elif held[1] in self.changing:
+                    break
+                else:
+                    nxt = held[1]
+                out.append(nxt if (new, nxt) in self.metatheses else new)
+                before = new
+            else:
+                # A last letter swaps with the one before it instead.
+                if len(held) < 2 and before is not None and (before, new) in self.metatheses:
+                    break
+                out.append(new)
+                before = None
+            held = held[1:]
+        return (out, before, held)
+
+    def flush(self, before, held):
+        """What is held, at the end of a word."""
+        if len(held) == 2:
+            (ph1, ph2) = held
+            new = self.assimilate(ph1, ph2)
+            return [ph2, new] if (new, ph2) in self.metatheses else [new, ph2]
+        if held:
+            ph = held[0]
+            return [before] if before is not None and (before, ph) in self.metatheses else [ph]
+        return []
+
+    def number(self, state):
+        number = self.numbers.get(state)
+        if number is None:
+            number = self.numbers[state] = len(self.states)
+            self.states.append(state)
+        return number
+
+    def step(self, number, ch):
+        key = (number, ch)
+        if key in self.moves:
+            return self.moves[key]
+        (state, before, held) = self.states[number]
+        (out, before, held) = self.settle(before, held + (ch,))
+        state = self.automaton.advance(state, ''.join(out))
+        result = None if state is None else self.number((state, before, held))
+        self.moves[key] = result
+        return result
+
+    def advance(self, number, text):
+        """The state after text, or None if a pattern turns up on the way."""
+        for ch in text:
+            number = self.step(number, ch)
+            if number is None:
+                return None
+        return number
+
+    def finish(self, number):
+        (state, before, held) = self.states[number]
+        return self.automaton.advance(state, ''.join(self.flush(before, held))) is not None
+
+    def search(self, word):
+        """True if any of the patterns occurs in word once it is
+        assimilated."""
+        number = self.advance(0, word)
+        return number is None or not self.finish(number)
@@ -0,0 +1,170 @@
+"""Vectorised word generation with numpy.
+
+SoundSystem.generate() makes a handful of calls into the random
+module for every word, which is what most of its time goes on when
+you ask for millions of words.  The BatchEngine here makes every
+random choice for a whole batch of words at once -- which rule, which
+phonemes, which optional slots are filled -- as numpy arrays, and
+only puts the words together one at a time.  Filters still run word
+by word.
+
+numpy isn't needed for anything else, so this module is only imported
+when asked for.
+"""
+from itertools import repeat
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import saturation
+import wordgen
+import wordspace
+from codes import WordCode, WordListCode
+
+
+class BatchEngine:
+    def __init__(self, sound_system, seed=None, batch_size=65536):
+        if np is None:
+            raise ImportError('The batch engine needs numpy.')
+        self.ss = sound_system
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.batch_size = batch_size
+        self.rules = list(sound_system.ruleset)
+        weights = np.array([sound_system.ruleset[rule] for rule in self.rules], dtype=float)
+        self.rule_cum = np.cumsum(weights)
+        # Every string a rule can emit gets a number, so that "the
+        # sound before this one" can be kept as an int array.
+        self.symbols = {}
+        self.classes = {}
+        for rule in self.rules:
+            for (op, arg) in sound_system.programs[rule]:
+                if op in (wordgen.LITERAL, wordgen.OPTIONAL_LITERAL):
+                    self.symbol(arg)
+                else:
+                    self.symbol_class(arg.__self__)
+        for table in self.classes.values():
+            table.index_symbols(len(self.symbols))
+
+    def symbol(self, text):
+        return self.symbols.setdefault(text, len(self.symbols))
+
+    def symbol_class(self, selector):
+        if id(selector) not in self.classes:
+            ids = [self.symbol(key) for key in selector.keys]
+            self.classes[id(selector)] = ClassTable(selector, ids)
+        return self.classes[id(selector)]
+
+    def select_rules(self, k):
+        picks = self.rng.random(k) * self.rule_cum[-1]
+        return np.minimum(np.searchsorted(self.rule_cum, picks, side='right'), len(self.rules) - 1)
+
+    def sample(self, k):
+        """k raw words, before filtering."""
+        rule_picks = self.select_rules(k)
+        words = [None] * k
+        for (r, rule) in enumerate(self.rules):
+            rows = np.flatnonzero(rule_picks == r)
+            if rows.size:
+                for (row, word) in zip(rows.tolist(), self.run_program(self.ss.programs[rule], rows.size)):
+                    words[row] = word
+        return words
+
+    def run_program(self, program, m):
+        """m runs of a compiled rule, each slot drawn for all m at once."""
+        columns = []
+        last = np.full(m, -1)  # symbol emitted last, -1 for none
+        for (op, arg) in program:
+            if op == wordgen.LITERAL:
+                columns.append(repeat(arg, m))
+                last[:] = self.symbols[arg]
+            elif op == wordgen.OPTIONAL_LITERAL:
+                chosen = self.coin_flips(m)
+                columns.append(np.where(chosen, arg, '').tolist())
+                last[chosen] = self.symbols[arg]
+            else:
+                table = self.classes[id(arg.__self__)]
+                if op == wordgen.DISTINCT:
+                    idx = table.select_except(self.rng, table.positions[last])
+                else:
+                    idx = table.select(self.rng, m)
+                if op == wordgen.OPTIONAL:
+                    chosen = self.coin_flips(m)
+                    columns.append(np.where(chosen, table.keys[idx], '').tolist())
+                    last[chosen] = table.ids[idx][chosen]
+                else:
+                    columns.append(table.keys[idx].tolist())
+                    last = table.ids[idx]
+        if not columns:
+            return [''] * m
+        return [''.join(parts) for parts in zip(*columns)]
+
+    # random.randint(0, 100) < randpercent, as run_program() does it.
+    def coin_flips(self, m):
+        return self.rng.integers(0, 101, m) < self.ss.randpercent
+
+    def generate(self, n=10, unsorted=False):
+        """Generate n unique words, as SoundSystem.generate() does."""
+        return self.generate_list(n, unsorted).words
+
+    def generate_list(self, n=10, unsorted=False):
+        """Like SoundSystem.generate_list(): a saturation.WordList of up
+        to n words, stopping early only if the language looks used up."""
+        ss = self.ss
+        ways = ss.count_possible()
+        if ways <= wordspace.SMALL_LANGUAGE and n * 2 >= ways:
+            # The whole language is listed, with nothing to batch.
+            return ss.generate_list(n, unsorted, self.seed)
+        tally = saturation.WordTally(ways)
+        words = []
+        status = WordListCode.SUCCESS
+        apply_filters = ss.apply_filters
+        while len(words) < n and status is WordListCode.SUCCESS:
+            for raw in self.sample(min(self.batch_size, max(n - len(words), 1) * 2)):
+                word = apply_filters(raw)
+                if tally.add(word) is WordCode.ACCEPT:
+                    words.append(word)
+                if len(words) >= n:
+                    break
+                if tally.exhausted():
+                    status = WordListCode.FAIL
+                    break
+        if ss.stats is not None:
+            ss.stats.add_tally(tally)
+        if not unsorted:
+            words = ss.sort_words(words)
+        return saturation.WordList(words, status, tally)
+
+
+# A phoneme class as arrays: cumulative weights for searchsorted(),
+# the keys as an object array to index into, and symbol numbers.
+class ClassTable:
+    def __init__(self, selector, ids):
+        self.keys = np.array(selector.keys, dtype=object)
+        self.weights = np.array(selector.weights, dtype=float)
+        self.cum = np.cumsum(self.weights)
+        self.start = self.cum - self.weights
+        self.ids = np.array(ids)
+        self.n = len(ids)
+
+    # positions[symbol] is where that symbol is in this class, or -1.
+    # The extra slot at the end catches symbol -1, "nothing yet".
+    def index_symbols(self, count):
+        self.positions = np.full(count + 1, -1)
+        self.positions[self.ids] = np.arange(self.n)
+
+    def select(self, rng, m):
+        picks = rng.random(m) * self.cum[-1]
+        return np.minimum(np.searchsorted(self.cum, picks, side='right'), self.n - 1)
+
+    # Draw from the class without the key at exclude (where it's not
+    # -1): draw from the smaller total, then step over the excluded
+    # key's share of the line.
+    def select_except(self, rng, exclude):
+        has = exclude >= 0
+        skip = np.where(has, self.weights[exclude], 0.0)
+        picks = rng.random(len(exclude)) * (self.cum[-1] - skip)
+        picks = np.where(has & (picks >= self.start[exclude]), picks + skip, picks)
+        return np.minimum(np.searchsorted(self.cum, picks, side='right'), self.n - 1)
@@ -0,0 +1,500 @@
+"""Rough timings for the word generator.
+
+Run from this directory, e.g:
+
+    python benchmark.py filters
+
+With --fuzz, the filters command checks the compiled filters against
+re.sub() on random filter lists instead of timing them, and the
+sampling command checks constrained sampling against generating and
+filtering.
+
+The suite command times everything for every example with fixed seeds
+and writes the results as JSON; compare reads two such files and
+flags what got slower:
+
+    python benchmark.py suite -o before.json
+    (change something)
+    python benchmark.py suite -o after.json
+    python benchmark.py compare before.json after.json
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+os.chdir(os.path.dirname(os.path.realpath(__file__)))
+
+import filters
+import smart_clusters as sc
+import wordgen
+from distribution import WeightedSelector, AliasSelector
+from phone_define_parser import PhonologyDefinition
+from wordgen import natural_weights, rule2dict, uca_collator, UnknownLetterError
+
+EXAMPLES = sorted(glob.glob('examples/*.def'))
+
+# How much worse than before a result in the suite may be, in percent,
+# before compare calls it a regression.
+THRESHOLD = 10.0
+# Times shorter than this, in seconds, are mostly timer noise, and
+# aren't compared.
+MIN_TIME = 0.001
+SUITE_FORMAT = 1
+
+# Most of a short run from the command line should be Python starting
+# up: the most lexifer may add to a bare interpreter, in seconds.
+CLI_BUDGET = 0.1
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def load(file_name, seed=1):
+    random.seed(seed)
+    return PhonologyDefinition(file_name).sound_system
+
+
+def raw_words(ss, count, seed=1):
+    random.seed(seed)
+    rules = list(ss.ruleset)
+    return [ss.run_rule(random.choice(rules)) for i in range(count)]
+
+
+# The filter loop as it was before filters were compiled.
+def sequential_filters(ss, word):
+    if ss.sorter:
+        w = list(word)
+        if ss.use_assim:
+            w = sc.apply_assimilations(w)
+        if ss.use_coronal_metathesis:
+            w = sc.apply_coronal_metathesis(w)
+        word = "".join(w)
+    for (pat, repl) in ss.filters:
+        word = re.sub(pat, repl, word)
+        if re.search('REJECT', word, flags=re.UNICODE):
+            return 'REJECT'
+    return word
+
+
+def bench_filters(args):
+    if args.fuzz:
+        return fuzz_filters(args.fuzz, args.seed)
+    print('%-30s %8s %9s %12s %12s %8s' % (
+        'definition', 'filters', 'rejected', 'before w/s', 'after w/s', 'speedup'))
+    for file_name in args.defs or EXAMPLES:
+        ss = load(file_name)
+        words = raw_words(ss, args.count)
+        before, t_before = timed(lambda: [sequential_filters(ss, w) for w in words])
+        after, t_after = timed(lambda: [ss.apply_filters(w) for w in words])
+        if before != after:
+            raise SystemExit('%s: compiled filters disagree with re.sub()' % file_name)
+        print('%-30s %8d %8.0f%% %12.0f %12.0f %7.2fx' % (
+            os.path.basename(file_name), len(ss.filters),
+            100.0 * after.count('REJECT') / len(words), len(words) / t_before, len(words) / t_after, t_before / t_after))
+
+
+# Random filter lists over a few letters, so that patterns and
+# replacements overlap often, each run by a FilterChain and by re.sub()
+# one filter at a time on random words.  FUSE_MIN is lowered for the
+# run so that short lists get fused too.
+def fuzz_filters(trials, seed, alphabet='abcdE'):
+    rng = random.Random(seed)
+    def letters(lo, hi):
+        return ''.join(rng.choice(alphabet) for i in range(rng.randint(lo, hi)))
+    def pattern():
+        pat = letters(1, 3)
+        anchor = rng.random()
+        if anchor < 0.1:
+            return '^' + pat
+        if anchor < 0.2:
+            return pat + '$'
+        return pat
+    fuse_min = filters.FUSE_MIN
+    filters.FUSE_MIN = 2
+    try:
+        fused = 0
+        for trial in range(trials):
+            flist = []
+            for i in range(rng.randint(1, 14)):
+                kind = rng.random()
+                if kind < 0.3:
+                    flist.append((pattern(), 'REJECT'))
+                elif kind < 0.35:
+                    flist.append((pattern(), ''))
+                elif kind < 0.4:
+                    pat = letters(1, 2)
+                    flist.append((pat, pat))
+                else:
+                    flist.append((pattern(), letters(1, 3)))
+            chain = filters.FilterChain(flist)
+            fused += any(isinstance(apply.__self__, filters.FusedLiteralStep)
+                         for (apply, check) in chain.steps)
+            for i in range(30):
+                word = letters(0, 10)
+                expected = word
+                for (pat, repl) in flist:
+                    expected = re.sub(pat, repl, expected)
+                    if 'REJECT' in expected:
+                        expected = 'REJECT'
+                        break
+                if chain(word) != expected:
+                    raise SystemExit('filters %r on %r: FilterChain gives %r, re.sub() %r' % (
+                        flist, word, chain(word), expected))
+    finally:
+        filters.FUSE_MIN = fuse_min
+    print('%d filter lists agree with re.sub() (%d with a fused step)' % (trials, fused))
+
+
+# WeightedSelector.select() as it was: a scan down the weights.
+def scan_select(sel):
+    pick = random.uniform(0, sel.sum)
+    tmp = 0
+    for i in range(sel.n):
+        tmp += sel.weights[i]
+        if pick < tmp:
+            return sel.keys[i]
+
+
+def bench_selectors(args):
+    print('%6s %14s %14s %14s %14s %14s' % (
+        'size', 'scan sel/s', 'linear sel/s', 'alias sel/s', 'linear many', 'alias many'))
+    random.seed(1)
+    for size in args.sizes:
+        weights = rule2dict(natural_weights(' '.join('p%d' % i for i in range(size))))
+        sel = WeightedSelector(weights)
+        row = [(args.count / timed(lambda: [scan_select(sel) for i in range(args.count)])[1],)]
+        for cls in (WeightedSelector, AliasSelector):
+            sel = cls(weights)
+            t = timed(lambda: [sel.select() for i in range(args.count)])[1]
+            t_many = timed(sel.select_many, args.count)[1]
+            row.append((args.count / t, args.count / t_many))
+        print('%6d %14.0f %14.0f %14.0f %14.0f %14.0f' % (
+            size, row[0][0], row[1][0], row[2][0], row[1][1], row[2][1]))
+
+
+def accepted_rate(ss, count):
+    # Words that get through the filters per second, and how many didn't.
+    make_raw = ss.raw_word_maker()
+    words, t = timed(lambda: [ss.apply_filters(make_raw()) for i in range(count)])
+    rejected = words.count('REJECT')
+    return (count - rejected) / t, rejected / count
+
+
+def bench_sampling(args):
+    if args.fuzz:
+        return fuzz_sampling(args.defs, args.fuzz, args.seed)
+    print('%-24s %9s %12s %9s %12s %8s %8s' % (
+        'definition', 'rejected', 'plain w/s', 'rejected', 'constr. w/s', 'setup', 'speedup'))
+    for file_name in args.defs:
+        ss = load(file_name)
+        random.seed(1)
+        plain, plain_rejected = accepted_rate(ss, args.count)
+        ss.use_constrained_sampling()
+        setup = timed(ss.raw_word_maker)[1]
+        random.seed(1)
+        constrained, constrained_rejected = accepted_rate(ss, args.count)
+        print('%-24s %8.1f%% %12.0f %8.1f%% %12.0f %7.2fs %7.2fx' % (
+            os.path.basename(file_name), 100 * plain_rejected, plain,
+            100 * constrained_rejected, constrained, setup, constrained / plain))
+
+
+# Two checks of constrained sampling.  First, that the automaton it
+# uses finds the same rejections in a raw word as the plain one does
+# in the word once assimilated, on random words over each
+# definition's letters, with assimilation, metathesis and both.
+# Second, that words come out as often as when generating and
+# filtering, on a small definition with both and a few rejections:
+# a chi-squared test over every word, failing beyond five standard
+# deviations.
+def fuzz_sampling(defs, count, seed):
+    from automaton import AhoCorasick
+    rng = random.Random(seed)
+    for file_name in defs:
+        ss = load(file_name)
+        if ss.sorter is None or not ss.raw_rejects():
+            print('%-24s no letters: or no rejections, skipped' % os.path.basename(file_name))
+            continue
+        letters = sorted(set(''.join(ss.sorter.graphs)))
+        plain = AhoCorasick(ss.raw_rejects())
+        for (assim, metathesis) in [(True, False), (False, True), (True, True)]:
+            ss.use_assim = assim
+            ss.use_coronal_metathesis = metathesis
+            automaton = ss.raw_reject_automaton()
+            for i in range(count):
+                word = ''.join(rng.choice(letters) for j in range(rng.randint(0, 8)))
+                if automaton.search(word) != plain.search(ss.assimilate(word)):
+                    raise SystemExit('%s: the automaton disagrees on %r (assimilation %s, metathesis %s)' % (
+                        file_name, word, assim, metathesis))
+        print('%-24s %d words agree, %d states' % (os.path.basename(file_name), 3 * count, len(automaton)))
+
+    def small(constrained):
+        random.seed(seed)
+        ss = wordgen.SoundSystem()
+        ss.use_ipa()
+        ss.add_sort_order('a i t d n k g p b m s')
+        ss.with_std_assimilations()
+        ss.with_coronal_metathesis()
+        ss.add_ph_unit('C', 't d n k g p b m s')
+        ss.add_ph_unit('V', 'a i')
+        for rule in ('CVCC', 'CVCCV', 'VCC'):
+            ss.add_rule(rule, 1)
+        for cluster in ('mp', 'ka', 'sb', 'gd'):
+            ss.add_filter(cluster, 'REJECT')
+        if constrained:
+            ss.use_constrained_sampling()
+        make_raw = ss.raw_word_maker()
+        words = [ss.apply_filters(make_raw()) for i in range(count)]
+        return collections.Counter(word for word in words if word != 'REJECT')
+    (plain, constrained) = (small(False), small(True))
+    (n1, n2) = (sum(plain.values()), sum(constrained.values()))
+    words = set(plain) | set(constrained)
+    chi2 = sum((plain[word] / n1 - constrained[word] / n2) ** 2 / (plain[word] + constrained[word])
+               for word in words) * n1 * n2
+    dof = len(words) - 1
+    verdict = 'agree' if chi2 <= dof + 5 * (2 * dof) ** 0.5 else 'DISAGREE'
+    print('word frequencies %s: chi-squared %.0f on %d degrees of freedom' % (verdict, chi2, dof))
+    if verdict != 'agree':
+        raise SystemExit('constrained sampling changes the odds of words')
+
+
+def bench_startup(args):
+    # A fresh interpreter each time, loading the collation table from
+    # the text and then from the cache made on the way.
+    load_table = 'from pyuca.collator import Collator; Collator("pyuca/allkeys.txt")'
+    def run():
+        return timed(subprocess.check_call, [sys.executable, '-c', load_table])[1]
+    for cache in glob.glob('pyuca/allkeys.*.marshal'):
+        os.remove(cache)
+    parsed = []
+    for i in range(args.count):
+        parsed.append(run())
+        for cache in glob.glob('pyuca/allkeys.*.marshal'):
+            os.remove(cache)
+    run()
+    cached = [run() for i in range(args.count)]
+    print('%-14s %10s' % ('allkeys.txt', 'best'))
+    print('%-14s %9.1fms' % ('parsed', 1000 * min(parsed)))
+    print('%-14s %9.1fms' % ('cached', 1000 * min(cached)))
+    print('%-14s %9.2fx' % ('speedup', min(parsed) / min(cached)))
+
+
+def bench_cli(args):
+    def run(command):
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+    def best(command):
+        return min(timed(run, command)[1] for i in range(args.count))
+    bare = best([sys.executable, '-c', 'pass'])
+    print('%-32s %10s %10s' % ('command', 'best', 'added'))
+    print('%-32s %8.1fms' % ('python -c pass', 1000 * bare))
+    over = False
+    for options in ([args.definition, '-n', '10', '-o'], [args.definition]):
+        t = best([sys.executable, '.'] + options)
+        over = over or t - bare > CLI_BUDGET
+        print('%-32s %8.1fms %8.1fms' % (' '.join(['lexifer'] + options), 1000 * t, 1000 * (t - bare)))
+    print('budget: %.0fms added, %s' % (1000 * CLI_BUDGET, 'OVER' if over else 'ok'))
+    if over:
+        sys.exit(1)
+
+
+def best_of(repeat, func, *args):
+    """func(*args) run repeat times: the last result, and the best time."""
+    times = []
+    for i in range(repeat):
+        result, t = timed(func, *args)
+        times.append(t)
+    return result, min(times)
+
+
+def sort_times(ss, words, repeat):
+    # Sorting the same words by letters:, by code point and by the
+    # Unicode Collation Algorithm, None where it can't be done.
+    def uca_sort():
+        collator.key_cache.clear()  # or every run after the first is free
+        return ss.sort_words(words)
+    collator = uca_collator()
+    times = {'letters': None, 'codepoint': best_of(repeat, sorted, words)[1], 'uca': None}
+    try:
+        if ss.sorter is not None:
+            times['letters'] = best_of(repeat, ss.sorter, words)[1]
+    except UnknownLetterError:
+        pass
+    ss.collator = collator
+    try:
+        times['uca'] = best_of(repeat, uca_sort)[1]
+    finally:
+        ss.collator = None
+    return times
+
+
+# Names ending in _s and _kib are better smaller, _wps (words a second)
+# better bigger.
+def bench_definition(file_name, args):
+    result = {}
+    ss, result['parse_s'] = best_of(args.repeat, load, file_name)
+    rules = list(ss.ruleset)
+    random.seed(1)
+    picks = [random.choice(rules) for i in range(args.count)]
+    result['run_rule_wps'] = args.count / best_of(
+        args.repeat, lambda: [ss.run_rule(rule) for rule in picks])[1]
+    raw = raw_words(ss, args.count)
+    # run_filters() rather than apply_filters(), which would mostly
+    # be timing the cache.
+    result['filters_wps'] = args.count / best_of(
+        args.repeat, lambda: [ss.run_filters(word) for word in raw])[1]
+    result['unique_wps'] = {}
+    words = []
+    def unique_words(n):
+        ss.compile_filters()  # starting with an empty filter cache every time
+        return ss.generate_list(n, True, 1).words
+    for n in args.sizes:
+        words, t = best_of(args.repeat, unique_words, n)
+        result['unique_wps'][str(n)] = len(words) / t
+    result['sort_s'] = sort_times(ss, words, args.repeat)
+    # Separately, as tracing slows everything down.
+    tracemalloc.start()
+    try:
+        load(file_name).generate_list(max(args.sizes), True, 1)
+        result['peak_kib'] = tracemalloc.get_traced_memory()[1] / 1024.0
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(args):
+    report = {
+        'format': SUITE_FORMAT,
+        'python': sys.version,
+        'platform': platform.platform(),
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'options': {'count': args.count, 'sizes': args.sizes, 'repeat': args.repeat},
+        'results': {},
+    }
+    for file_name in args.defs or EXAMPLES:
+        sys.stderr.write('%s\n' % file_name)
+        report['results'][os.path.basename(file_name)] = bench_definition(file_name, args)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def flatten(results):
+    """{(definition, metric): value}, with nested metrics joined by dots."""
+    flat = {}
+    def walk(definition, prefix, value):
+        if isinstance(value, dict):
+            for (key, sub) in value.items():
+                walk(definition, prefix + '.' + key if prefix else key, sub)
+        elif value is not None:
+            flat[(definition, prefix)] = value
+    for (definition, metrics) in results.items():
+        walk(definition, '', metrics)
+    return flat
+
+
+def change(metric, old, new):
+    """How much worse new is than old, in percent (negative if better)."""
+    if metric.split('.')[0].endswith('_wps'):
+        return 100.0 * (old - new) / old if old else 0.0
+    return 100.0 * (new - old) / old if old else 0.0
+
+
+def bench_compare(args):
+    reports = []
+    for file_name in (args.old, args.new):
+        with open(file_name) as f:
+            reports.append(json.load(f))
+    (old, new) = [flatten(report['results']) for report in reports]
+    if reports[0].get('options') != reports[1].get('options'):
+        sys.stderr.write('** The runs were made with different options.\n')
+    regressions = 0
+    print('%-24s %-22s %12s %12s %8s' % ('definition', 'metric', 'old', 'new', 'worse'))
+    for key in sorted(set(old) & set(new)):
+        worse = change(key[1], old[key], new[key])
+        flag = ''
+        if key[1].split('.')[0].endswith('_s') and max(old[key], new[key]) < MIN_TIME:
+            flag = '  (too short to tell)'
+        elif worse > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('%-24s %-22s %12.4g %12.4g %7.1f%%%s' % (key + (old[key], new[key], worse, flag)))
+    for key in sorted(set(old) ^ set(new)):
+        print('%-24s %-22s %s' % (key + ('only in ' + (args.old if key in old else args.new),)))
+    print('%d regression%s beyond %.0f%%' % (regressions, '' if regressions == 1 else 's', args.threshold))
+    if regressions:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('filters', help='apply_filters() against the old re.sub() loop')
+    p.add_argument('defs', nargs='*', help='definition files (default: examples/*.def)')
+    p.add_argument('-c', '--count', type=int, default=5000, help='words per definition')
+    p.add_argument('--fuzz', type=int, metavar='TRIALS',
+                   help='instead, check random filter lists against re.sub()')
+    p.add_argument('--seed', type=int, default=0, help='for --fuzz')
+    p.set_defaults(func=bench_filters)
+    p = commands.add_parser('selectors', help='linear against alias-method phoneme selection')
+    p.add_argument('-s', '--sizes', type=int, nargs='+', default=[2, 5, 10, 20, 40, 80, 160, 320],
+                   help='class sizes to try')
+    p.add_argument('-c', '--count', type=int, default=200000, help='selections per class')
+    p.set_defaults(func=bench_selectors)
+    p = commands.add_parser('sampling', help='constrained sampling against generate-and-filter')
+    p.add_argument('defs', nargs='*', default=['examples/fake-hungarian.def', 'examples/ancient-greek.def'],
+                   help='definition files')
+    p.add_argument('-c', '--count', type=int, default=20000, help='words per definition')
+    p.add_argument('--fuzz', type=int, metavar='WORDS',
+                   help='instead, check the reject automaton and word odds on this many words')
+    p.add_argument('--seed', type=int, default=0, help='for --fuzz')
+    p.set_defaults(func=bench_sampling)
+    p = commands.add_parser('startup', help='loading the collation table, parsed and cached')
+    p.add_argument('-c', '--count', type=int, default=10, help='runs of each')
+    p.set_defaults(func=bench_startup)
+    p = commands.add_parser('cli', help='cold start of the command line against its budget')
+    p.add_argument('definition', nargs='?', default='examples/anng.def', help='definition file')
+    p.add_argument('-c', '--count', type=int, default=10, help='runs of each')
+    p.set_defaults(func=bench_cli)
+    p = commands.add_parser('suite', help='everything, for every example, as JSON')
+    p.add_argument('defs', nargs='*', help='definition files (default: examples/*.def)')
+    p.add_argument('-c', '--count', type=int, default=5000, help='raw words to time rules and filters on')
+    p.add_argument('-s', '--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                   help='numbers of unique words to generate')
+    p.add_argument('-r', '--repeat', type=int, default=5, help='runs of each, the best is kept')
+    p.add_argument('-o', '--output', help='file to write (default: stdout)')
+    p.set_defaults(func=bench_suite)
+    p = commands.add_parser('compare', help='two suite results, flagging regressions')
+    p.add_argument('old', help='JSON from suite, before')
+    p.add_argument('new', help='JSON from suite, after')
+    p.add_argument('-t', '--threshold', type=float, default=THRESHOLD,
+                   help='percent worse that counts as a regression (default: %(default)s)')
+    p.set_defaults(func=bench_compare)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
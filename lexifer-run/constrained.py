@@ -0,0 +1,125 @@
+"""Sampling words that can't be rejected.
+
+With a long reject: list (or a cluster field full of '-'), much of what
+run_rule() makes is thrown away again by the filters.  The sampler here
+never draws a sound that would complete a literal rejection.  For each
+rule it works out, from the end backwards, the chance that a run
+starting at a given slot -- with the reject automaton in a given state
+and a given last sound -- gets to the end without being rejected.
+Every draw is then weighted by that chance as well as the usual
+weights, and so is the choice of rule.  That gives each word exactly
+the odds it has when generating at random and throwing rejects away,
+only without the throwing away.
+
+The rejections are those SoundSystem.raw_rejects() gives, looked for
+in the word as assimilation and metathesis will leave it (see
+AssimilatedAutomaton); the last letters are only settled once the
+run ends.  The filters still run on every word, and anything else
+they reject is simply drawn again.
+"""
+import random
+from bisect import bisect_right
+
+import wordgen
+import wordspace
+
+
+class ConstrainedSampler:
+    def __init__(self, sound_system):
+        automaton = sound_system.raw_reject_automaton()
+        fill = wordspace.fill_chance(sound_system)
+        self.rules = []
+        self.cumulative = []
+        self.total = 0.0
+        for (rule, weight) in sound_system.ruleset.items():
+            root = RuleSampler(sound_system.programs[rule], automaton, fill).root
+            if weight > 0 and root.total > 0:
+                self.total += weight * root.total
+                self.rules.append(root)
+                self.cumulative.append(self.total)
+
+    def sample(self):
+        """A raw word, before filtering."""
+        i = bisect_right(self.cumulative, random.random() * self.total)
+        return self.rules[min(i, len(self.rules) - 1)].sample()
+
+
+# A point part way through a run of a rule.  total is the chance of
+# getting from here to the end without being rejected; the moves are
+# what can be emitted next (None for an empty optional slot) and where
+# that leads, with running totals of their weights to draw from.
+class Node:
+    __slots__ = ['sounds', 'children', 'cumulative', 'total']
+
+    def __init__(self):
+        self.sounds = []
+        self.children = []
+        self.cumulative = []
+        self.total = 0.0
+
+    def sample(self):
+        parts = []
+        node = self
+        while node.sounds:
+            i = bisect_right(node.cumulative, random.random() * node.total)
+            i = min(i, len(node.sounds) - 1)
+            if node.sounds[i] is not None:
+                parts.append(node.sounds[i])
+            node = node.children[i]
+        return ''.join(parts)
+
+
+class RuleSampler:
+    def __init__(self, program, automaton, fill):
+        self.program = program
+        self.automaton = automaton
+        self.fill = fill
+        self.choices = wordspace.program_choices(program)
+        # The last sound only matters to a '!' slot, and to the slots
+        # before it up to the nearest one that always emits something.
+        self.needs_last = [False] * (len(program) + 1)
+        for i in range(len(program) - 1, -1, -1):
+            op = program[i][0]
+            if op == wordgen.DISTINCT:
+                self.needs_last[i] = True
+            elif op in (wordgen.OPTIONAL, wordgen.OPTIONAL_LITERAL):
+                self.needs_last[i] = self.needs_last[i + 1]
+        self.nodes = {}
+        self.end = Node()
+        self.end.total = 1.0
+        self.dead = Node()  # a run that ends in a rejection
+        self.root = self.node(0, 0, None)
+
+    def node(self, i, state, last):
+        if i == len(self.program):
+            if self.automaton is None or self.automaton.finish(state):
+                return self.end
+            return self.dead
+        if not self.needs_last[i]:
+            last = None
+        key = (i, state, last)
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = self.build(i, state, last)
+        return node
+
+    def build(self, i, state, last):
+        node = Node()
+        for (ph, p) in wordspace.slot_options(self.program[i][0], self.choices[i], last, self.fill):
+            if p <= 0:
+                continue
+            if ph is None:
+                child = self.node(i + 1, state, last)
+            else:
+                nstate = state
+                if self.automaton is not None:
+                    nstate = self.automaton.advance(state, ph)
+                    if nstate is None:
+                        continue
+                child = self.node(i + 1, nstate, ph)
+            if child.total > 0:
+                node.total += p * child.total
+                node.sounds.append(ph)
+                node.children.append(child)
+                node.cumulative.append(node.total)
+        return node
@@ -0,0 +1,85 @@
+import math
+
+# Ways of telling whether a word has been seen before, for
+# SoundSystem.iter_words().  Each has an add() method which records a
+# word and says whether it was new.
+
+
+class ExactDedup:
+    """Remembers every word.  Never wrong, but memory grows with output."""
+
+    def __init__(self):
+        self.seen = set()
+
+    def add(self, word):
+        if word in self.seen:
+            return False
+        self.seen.add(word)
+        return True
+
+    def __len__(self):
+        return len(self.seen)
+
+
+class NoDedup:
+    """Lets everything through, repeats and all."""
+
+    def add(self, word):
+        return True
+
+
+class BloomDedup:
+    """Fixed memory, sized for capacity words at the given error rate.
+
+    A Bloom filter never lets a repeat through, but it will now and
+    then take a new word for a repeat and drop it.  Up to capacity
+    words, that happens at about error_rate; past it, more often.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1.')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        from hashlib import blake2b  # here, as hashlib is slow to import
+        self.blake2b = blake2b
+
+    # Double hashing off one digest.  hash() would do, but it differs
+    # from process to process.
+    def positions(self, word):
+        digest = self.blake2b(word.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, word):
+        new = False
+        for pos in self.positions(word):
+            mask = 1 << (pos & 7)
+            if not self.bits[pos >> 3] & mask:
+                self.bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __len__(self):
+        return self.count
+
+
+DEDUPS = {
+    'exact': ExactDedup,
+    'bloom': BloomDedup,
+    'none': NoDedup,
+}
+
+
+def make_dedup(kind='exact', **options):
+    """A deduplicator by name: 'exact', 'bloom' or 'none'."""
+    if kind not in DEDUPS:
+        raise ValueError('Unknown deduplication: %s' % kind)
+    return DEDUPS[kind](**options)
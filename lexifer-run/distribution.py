@@ -1,11 +1,13 @@
 import random
+from array import array
+from bisect import bisect_right
 
 # When you are selecting from a pool a *lot*, this
 # will speed things up a bit.  Takes a dict of keys
 # and weights.
 class WeightedSelector(object):
-#    __slots__ = ['keys', 'weights', 'sum', 'n']
-    
+    __slots__ = ['keys', 'weights', 'sum', 'n', 'cumulative', 'excluding']
+
     def __init__(self, dic):
         # build parallel arrays for indexing
         self.keys = []
@@ -15,15 +17,100 @@ class WeightedSelector(object):
             self.weights.append(weight)
         self.sum = sum(self.weights)
         self.n = len(self.keys)
+        # Running totals, added up in the same order select() used
+        # to, so a bisect finds the same key the old linear scan did.
+        self.cumulative = []
+        tmp = 0
+        for weight in self.weights:
+            tmp += weight
+            self.cumulative.append(tmp)
+        self.excluding = {}
 
     def select(self):
         pick = random.uniform(0, self.sum)
-        tmp = 0
-        for i in range(self.n):
-            tmp += self.weights[i]
-            if pick < tmp:
-                return self.keys[i]
+        i = bisect_right(self.cumulative, pick)
+        if i < self.n:
+            return self.keys[i]
         return 'this shouldn\'t happen'
 
+    def select_many(self, k):
+        """Make k selections at once."""
+        return random.choices(self.keys, cum_weights=self.cumulative, k=k)
+
+    def select_except(self, key):
+        """Select anything but key, with the other weights unchanged.
+
+        The same as calling select() until it gives something other
+        than key, but it takes one draw however heavy key is.
+        """
+        if key not in self.excluding:
+            if key not in self.keys:
+                return self.select()
+            i = self.keys.index(key)
+            rest = dict(zip(self.keys[:i] + self.keys[i+1:],
+                            self.weights[:i] + self.weights[i+1:]))
+            self.excluding[key] = self.__class__(rest)
+        return self.excluding[key].select()
+
+    def __len__(self):
+        return self.n
+
     def __iter__(self):
-        return iter(self.keys)
\ No newline at end of file
+        return iter(self.keys)
+
+
+# Walker's alias method (in Vose's formulation).  Selection takes the
+# same time however many keys there are, at the cost of a table
+# built up front.  Draws differ from WeightedSelector's for the same
+# seed, though the odds are the same.
+class AliasSelector(WeightedSelector):
+    __slots__ = ['prob', 'alias']
+
+    def __init__(self, dic):
+        super().__init__(dic)
+        n = self.n
+        if not self.sum > 0:
+            # Nothing to choose between: select as WeightedSelector does.
+            self.prob = None
+            return
+        scaled = [weight * n / self.sum for weight in self.weights]
+        self.prob = array('d', [1.0]) * n
+        self.alias = array('l', range(n))
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # Whatever is left over is full, bar rounding errors.
+
+    def select(self):
+        if self.prob is None:
+            return super().select()
+        # One draw gives both the column and the coin toss.
+        u = random.random() * self.n
+        i = int(u)
+        if u - i < self.prob[i]:
+            return self.keys[i]
+        return self.keys[self.alias[i]]
+
+    def select_many(self, k):
+        if self.prob is None:
+            return [super(AliasSelector, self).select() for j in range(k)]
+        rand = random.random
+        n = self.n
+        keys = self.keys
+        prob = self.prob
+        alias = self.alias
+        picks = []
+        for j in range(k):
+            u = rand() * n
+            i = int(u)
+            picks.append(keys[i] if u - i < prob[i] else keys[alias[i]])
+        return picks
@@ -0,0 +1,117 @@
+"""Sorting more words than will fit in memory.
+
+Words are read in runs of run_size, each run is sorted and written to
+a temporary file, and the files are merged.  What gets written is
+each word's sort key rather than the word: for a letters: order, its
+graph values as big-endian 16-bit ints, and otherwise its UTF-8 bytes,
+which sort in code point order just as str does.  Either way plain
+byte comparison gives the right order, so the merge never has to
+split a word again, and the word is read back from its key.  A
+Unicode collation key can't be read back, so the word follows it.
+"""
+import heapq
+import struct
+import tempfile
+from itertools import islice
+
+RUN_SIZE = 100000  # words sorted in memory at a time
+LENGTH = struct.Struct('>I')
+
+
+class CodepointKeys:
+    def encode(self, word):
+        return word.encode('utf-8')
+
+    def decode(self, key):
+        return key.decode('utf-8')
+
+
+class SorterKeys:
+    """Keys for an ArbSorter's order."""
+
+    def __init__(self, sorter):
+        self.sorter = sorter
+        self.code = 'H' if len(sorter.vals) <= 0x10000 else 'I'
+
+    def encode(self, word):
+        values = self.sorter.word_as_values(word)
+        return struct.pack('>%d%s' % (len(values), self.code), *values)
+
+    def decode(self, key):
+        count = len(key) // struct.calcsize(self.code)
+        return self.sorter.values_as_word(struct.unpack('>%d%s' % (count, self.code), key))
+
+
+class CollatorKeys:
+    """Keys for a pyuca Collator's order.
+
+    A complete key is never the start of another, so with the word
+    after it, records sort by key, then by code point.
+    """
+
+    def __init__(self, collator):
+        from pyuca.collator import pack_key
+        self.collator = collator
+        self.pack_key = pack_key
+
+    def encode(self, word):
+        return self.pack_key(self.collator.sort_key(word)) + word.encode('utf-8')
+
+    def decode(self, key):
+        # The key ends with the zero weight after its third level.
+        end = 0
+        for level in range(3):
+            end = key.find(b'\0\0', end)
+            while end % 2:
+                end = key.find(b'\0\0', end + 1)
+            end += 2
+        return key[end:].decode('utf-8')
+
+
+def write_run(keys, directory=None):
+    run = tempfile.TemporaryFile(dir=directory)
+    for key in keys:
+        run.write(LENGTH.pack(len(key)))
+        run.write(key)
+    run.seek(0)
+    return run
+
+
+def read_run(run):
+    size = LENGTH.size
+    while True:
+        head = run.read(size)
+        if not head:
+            return
+        yield run.read(LENGTH.unpack(head)[0])
+
+
+def sort_words(words, sorter=None, run_size=RUN_SIZE, directory=None, collator=None):
+    """Yield words (any iterable of them) in order: the collator's,
+    the sorter's, or code point order without either.  At most
+    run_size words are held in memory at once; the rest wait in
+    temporary files in directory."""
+    if collator is not None:
+        keys = CollatorKeys(collator)
+    elif sorter is not None:
+        keys = SorterKeys(sorter)
+    else:
+        keys = CodepointKeys()
+    words = iter(words)
+    runs = []
+    try:
+        while True:
+            run = sorted(map(keys.encode, islice(words, run_size)))
+            if len(run) < run_size and not runs:
+                # Everything fitted in the one run.
+                for key in run:
+                    yield keys.decode(key)
+                return
+            if not run:
+                break
+            runs.append(write_run(run, directory))
+        for key in heapq.merge(*[read_run(run) for run in runs]):
+            yield keys.decode(key)
+    finally:
+        for run in runs:
+            run.close()
@@ -0,0 +1,328 @@
+import re
+from collections import OrderedDict
+
+from automaton import AhoCorasick
+
+# Filters are compiled once, when the definition is loaded, into a
+# list of steps.  Applying a filter list one pattern at a time with
+# re.sub() leans on the re module cache, which thrashes once a
+# definition has a few hundred filters (cluster fields add up fast).
+
+# Characters that give a pattern regular expression meaning.  A
+# pattern without any of them matches itself literally.
+REGEX_CHARS = frozenset('.^$*+?{}[]|()\\')
+REJECT_CHARS = frozenset('REJECT')
+# Patterns that refer to their own groups by number can't be joined
+# into one big alternation.
+GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+
+def is_literal(pat, repl):
+    """True if re.sub(pat, repl, word) == word.replace(pat, repl)."""
+    return pat != '' and not REGEX_CHARS.intersection(pat) and '\\' not in repl
+
+
+def overlaps(a, b):
+    """True if an occurrence of a can share characters with one of b."""
+    if a in b or b in a:
+        return True
+    for k in range(1, min(len(a), len(b))):
+        if a.endswith(b[:k]) or b.endswith(a[:k]):
+            return True
+    return False
+
+
+class LiteralStep:
+    __slots__ = ['pat', 'repl']
+
+    def __init__(self, pat, repl):
+        self.pat = pat
+        self.repl = repl
+
+    # A step is "safe" if it can never break up a 'REJECT' already
+    # in the word, so the check for it can wait until later.
+    def safe(self):
+        return not REJECT_CHARS.intersection(self.pat)
+
+    def apply(self, word):
+        return word.replace(self.pat, self.repl)
+
+
+# Several literal filters done in a single pass.  Only built from
+# filters that can't see each other's work (see can_fuse()), so one
+# pass gives the same answer as running them in order.
+class FusedLiteralStep:
+    __slots__ = ['table', 'regex']
+
+    def __init__(self, filters):
+        self.table = dict(filters)
+        self.regex = re.compile('|'.join(re.escape(pat) for (pat, repl) in filters))
+
+    def safe(self):
+        return not any(REJECT_CHARS.intersection(pat) for pat in self.table)
+
+    def replace(self, match):
+        return self.table[match.group(0)]
+
+    def apply(self, word):
+        return self.regex.sub(self.replace, word)
+
+
+# Every 'reject:' pattern and '-' cluster cell in a row, matched at
+# once.  A rejection never changes a word it doesn't match, so a run
+# of them amounts to "does any of these occur?".  Literal clusters go
+# through an Aho-Corasick automaton, everything else through as few
+# regexes as the patterns allow.
+class RejectStep:
+    __slots__ = ['patterns', 'automaton', 'regexes']
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        literals = [pat for pat in patterns if is_literal(pat, 'REJECT')]
+        others = [pat for pat in patterns if not is_literal(pat, 'REJECT')]
+        self.automaton = AhoCorasick(literals) if literals else None
+        self.regexes = [re.compile(pat) for pat in others if GROUP_REFERENCE.search(pat)]
+        joinable = [pat for pat in others if not GROUP_REFERENCE.search(pat)]
+        if joinable:
+            try:
+                self.regexes.insert(0, re.compile('|'.join('(?:%s)' % pat for pat in joinable)))
+            except re.error:
+                # Probably inline flags, which have to come first.
+                self.regexes[:0] = [re.compile(pat) for pat in joinable]
+
+    def safe(self):
+        return True
+
+    def apply(self, word):
+        if self.automaton is not None and self.automaton.search(word):
+            return 'REJECT'
+        for regex in self.regexes:
+            if regex.search(word):
+                return 'REJECT'
+        return word
+
+
+class RegexStep:
+    __slots__ = ['regex', 'repl']
+
+    def __init__(self, pat, repl):
+        self.regex = re.compile(pat)
+        self.repl = repl
+
+    def safe(self):
+        return False
+
+    def apply(self, word):
+        return self.regex.sub(self.repl, word)
+
+
+# Literal filters f1..fk give the same result in one pass as in
+# sequence when:
+#
+#   - no two patterns overlap, so an occurrence of one is never spoiled
+#     by an earlier replacement of another, and at most one of them
+#     matches at any place in the word;
+#   - no replacement overlaps the pattern of a later filter, so nothing
+#     a filter writes can be matched by a later one whatever is written
+#     around it (a filter never sees its own work, nor does an earlier
+#     one, in either version);
+#   - no replacement is empty, so a deletion can't join two pieces of
+#     the word into a new match (overlaps() counts '' as overlapping
+#     everything).
+#
+# Then every filter replaces just the occurrences it would have found
+# in the word as it first was.  Cluster fields meet this more often
+# than not: the cells of a row like 'ŋ > mm nn mp nt' never overlap,
+# even though each writes letters the others look for.
+#
+# On top of that, only the first filter of a group may touch a
+# 'REJECT' in the word: the sequential version looks for it between
+# filters, the fused one can't.
+def can_fuse(group, pat, repl):
+    if REJECT_CHARS.intersection(pat):
+        return False
+    for (p, r) in group:
+        if overlaps(p, pat) or overlaps(r, pat):
+            return False
+    return True
+
+
+# Below this many filters a run of str.replace() calls beats a
+# single regex pass.
+FUSE_MIN = 8
+
+
+def literal_steps(group):
+    if len(group) >= FUSE_MIN:
+        return [FusedLiteralStep(group)]
+    return [LiteralStep(pat, repl) for (pat, repl) in group]
+
+
+# A literal rejection can be looked for before a filter that can't
+# make or break an occurrence of it: another rejection, or a literal
+# filter whose pattern and replacement don't overlap it (an empty
+# replacement overlaps everything).  The filter must also be safe, so
+# that a 'REJECT' already in the word is still there when the
+# rejection's old turn comes.  Moving rejections forward like this
+# means most rejected words are thrown out before any filtering is
+# done at all.
+def commutes(filt, rejection):
+    (pat, repl) = filt
+    if repl == 'REJECT':
+        return True
+    return (is_literal(pat, repl) and not REJECT_CHARS.intersection(pat)
+            and not overlaps(pat, rejection) and not overlaps(repl, rejection))
+
+
+def hoist_rejects(filters):
+    hoisted = []
+    for (pat, repl) in filters:
+        pos = len(hoisted)
+        if repl == 'REJECT' and is_literal(pat, repl):
+            while pos > 0 and commutes(hoisted[pos - 1], pat):
+                pos -= 1
+        hoisted.insert(pos, (pat, repl))
+    return hoisted
+
+
+def compile_steps(filters):
+    # A literal filter that puts back what it finds does nothing (a
+    # cluster cell that repeats its own cluster, say).
+    filters = [(pat, repl) for (pat, repl) in filters
+               if not (pat == repl and is_literal(pat, repl))]
+    steps = []
+    group = []
+    rejects = []
+    for (pat, repl) in hoist_rejects(filters):
+        if repl == 'REJECT':
+            if group:
+                steps += literal_steps(group)
+                group = []
+            rejects.append(pat)
+            continue
+        if rejects:
+            steps.append(RejectStep(rejects))
+            rejects = []
+        if is_literal(pat, repl):
+            if group and not can_fuse(group, pat, repl):
+                steps += literal_steps(group)
+                group = []
+            group.append((pat, repl))
+            continue
+        if group:
+            steps += literal_steps(group)
+            group = []
+        steps.append(RegexStep(pat, repl))
+    if group:
+        steps += literal_steps(group)
+    if rejects:
+        steps.append(RejectStep(rejects))
+    return steps
+
+
+class FilterChain:
+    """A list of (pattern, replacement) filters, compiled for speed.
+
+    Calling the chain on a word gives the same result as:
+
+        for (pat, repl) in filters:
+            word = re.sub(pat, repl, word)
+            if 'REJECT' in word:
+                return 'REJECT'
+        return word
+    """
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+        steps = compile_steps(self.filters)
+        # Once 'REJECT' turns up in a word it stays there until an
+        # unsafe step runs, so we only need to look for it before an
+        # unsafe step and at the very end -- and after a rejection,
+        # which hands back a bare 'REJECT'.
+        self.steps = []
+        for (i, step) in enumerate(steps):
+            last = i == len(steps) - 1
+            check = last or isinstance(step, RejectStep) or not steps[i + 1].safe()
+            self.steps.append((step.apply, check))
+        # A step whose apply() can give different answers for the
+        # same word says so with deterministic = False.
+        self.deterministic = all(getattr(step, 'deterministic', True) for step in steps)
+
+    def __len__(self):
+        return len(self.filters)
+
+    def leading_rejects(self):
+        """Literal rejections checked before any filter changes a word."""
+        if self.steps and isinstance(self.steps[0][0].__self__, RejectStep):
+            automaton = self.steps[0][0].__self__.automaton
+            if automaton is not None:
+                return list(automaton.patterns)
+        return []
+
+    def __call__(self, word):
+        for (apply, check) in self.steps:
+            word = apply(word)
+            if check and 'REJECT' in word:
+                return 'REJECT'
+        return word
+
+
+# A miss costs the cache about as much as the filters of a short list
+# take, so a cache with fewer than WARMUP_HITS hits by the time it has
+# missed WARMUP_MISSES words turns itself off.
+WARMUP_MISSES = 450
+WARMUP_HITS = 50
+
+
+class FilterCache:
+    """What the filters made of the last maxsize raw words.
+
+    Short rules over small classes make the same raw words again and
+    again, and each would otherwise go through the whole of
+    SoundSystem.apply_filters() every time.  Words least recently
+    looked up are dropped first.  The cache only stays on while the
+    filters are deterministic and have something to do (see reset()),
+    and while it is hit often enough to pay for itself; it is never
+    pickled with its contents.
+    """
+
+    def __init__(self, maxsize=50000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.on = maxsize > 0
+
+    def reset(self, useful=True):
+        """Forget everything, for when the filters change."""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.on = useful and self.maxsize > 0
+
+    def lookup(self, word, compute):
+        """compute(word), from the cache if it's there."""
+        entries = self.entries
+        if word in entries:
+            self.hits += 1
+            entries.move_to_end(word)
+            return entries[word]
+        self.misses += 1
+        result = entries[word] = compute(word)
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+        if self.misses == WARMUP_MISSES and self.hits < WARMUP_HITS:
+            # Mostly new words: not worth keeping them.
+            self.on = False
+            entries.clear()
+        return result
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        return {'maxsize': self.maxsize, 'on': self.on}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxsize'])
+        self.on = state['on']
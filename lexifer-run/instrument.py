@@ -0,0 +1,262 @@
+"""Counting and timing what goes on while words are made.
+
+SoundSystem.enable_stats() hands back a PipelineStats and from then on
+fills it in: the time spent picking rules, running them, splitting
+words for assimilation and metathesis, and filtering; for each
+compiled filter step, how many words it saw, changed and rejected;
+and the attempts, repeats and rejects of every generate().
+
+Nothing here is looked at until stats are enabled.  The sound system
+then makes its words through the profiled versions below instead of
+the usual ones: a rule runner that reads the clock, and a ProfiledChain
+in place of its FilterChain.  The only cost left in the usual path is
+one test per word that misses the filter cache.
+
+Filters are timed as they are compiled (see filters.py): a run of
+rejections, or of literal filters fused into one pass, is one step
+with one time.  Hits and rejections are still counted per filter, by
+looking again at the words a step changed to see which of its filters
+did it.  Words the filter cache already knew don't reach the filters
+at all; the cache's own hits are reported alongside.
+
+Counts are kept by the process that makes the words, so generating
+with workers counts nothing.
+"""
+import re
+import time
+
+from filters import is_literal
+
+
+class Stage:
+    __slots__ = ['calls', 'seconds']
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {'calls': self.calls, 'seconds': self.seconds}
+
+
+class StepStats:
+    """One compiled filter step, and the filters it was made from."""
+
+    def __init__(self, step):
+        self.kind = type(step).__name__
+        self.filters = step_filters(step)
+        self.calls = 0
+        self.seconds = 0.0
+        self.changed = 0
+        self.rejected = 0
+        # filter -> [words it changed, words it rejected]
+        self.counts = {filt: [0, 0] for filt in self.filters}
+        # How to tell whether each filter matches a word.
+        self.matchers = []
+        if len(self.filters) > 1:
+            for (pat, repl) in self.filters:
+                if is_literal(pat, repl):
+                    self.matchers.append(lambda word, pat=pat: pat in word)
+                else:
+                    self.matchers.append(re.compile(pat).search)
+
+    def label(self):
+        if len(self.filters) == 1:
+            return describe(self.filters[0])
+        return '%s of %d' % (self.kind, len(self.filters))
+
+    def blame(self, before, after):
+        # Which of the step's filters did what it did to a word.
+        if len(self.filters) == 1:
+            self.counts[self.filters[0]][after == 'REJECT'] += 1
+            return
+        for (filt, matches) in zip(self.filters, self.matchers):
+            if matches(before):
+                rejects = filt[1] == 'REJECT'
+                self.counts[filt][rejects] += 1
+                if rejects:
+                    return  # the first one to match rejects
+
+    def as_dict(self):
+        return {
+            'step': self.label(),
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'changed': self.changed,
+            'rejected': self.rejected,
+            'filters': [{'filter': describe(filt), 'hits': hits, 'rejected': rejected}
+                        for (filt, (hits, rejected)) in self.counts.items()],
+        }
+
+
+def step_filters(step):
+    if hasattr(step, 'table'):
+        return list(step.table.items())
+    if hasattr(step, 'patterns'):
+        return [(pat, 'REJECT') for pat in step.patterns]
+    if hasattr(step, 'regex'):
+        return [(step.regex.pattern, step.repl)]
+    return [(step.pat, step.repl)]
+
+
+def describe(filt):
+    (pat, repl) = filt
+    if repl == 'REJECT':
+        return 'reject: %s' % pat
+    return '%s > %s' % (pat, repl or '!')
+
+
+class PipelineStats:
+    def __init__(self, filter_cache=None):
+        self.select = Stage()      # picking a rule
+        self.run_rule = Stage()    # running it
+        self.assimilate = Stage()  # splitting, assimilation, metathesis
+        self.filters = Stage()     # the whole filter chain
+        self.steps = []            # a StepStats per filter step
+        self.blaming = 0.0         # of filters' time, spent in StepStats.blame()
+        self.filter_cache = filter_cache
+        self.generated = 0         # generate() calls
+        self.draws = 0
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    def add_tally(self, tally):
+        """Add in the totals of a saturation.WordTally."""
+        self.generated += 1
+        self.draws += tally.draws
+        self.accepted += tally.accepted
+        self.duplicates += tally.duplicates
+        self.rejected += tally.rejected
+
+    def raw_word_maker(self, selector, programs, run_program):
+        stage_select = self.select
+        stage_run = self.run_rule
+        clock = time.perf_counter
+        def make_raw():
+            start = clock()
+            rule = selector.select()
+            middle = clock()
+            word = run_program(programs[rule])
+            end = clock()
+            stage_select.calls += 1
+            stage_select.seconds += middle - start
+            stage_run.calls += 1
+            stage_run.seconds += end - middle
+            return word
+        return make_raw
+
+    def timed(self, stage, func):
+        """func, adding the time it takes to stage."""
+        clock = time.perf_counter
+        def timed_func(*args):
+            start = clock()
+            result = func(*args)
+            stage.seconds += clock() - start
+            stage.calls += 1
+            return result
+        return timed_func
+
+    def run_filters(self, ss, word):
+        """SoundSystem.run_filters(), timed."""
+        clock = time.perf_counter
+        if ss.sorter and (ss.use_assim or ss.use_coronal_metathesis):
+            start = clock()
+            word = ss.assimilate(word)
+            self.assimilate.seconds += clock() - start
+            self.assimilate.calls += 1
+        if ss.filter_chain is None:
+            ss.compile_filters()
+        start = clock()
+        blaming = self.blaming
+        word = ss.filter_chain(word)
+        self.filters.seconds += clock() - start - (self.blaming - blaming)
+        self.filters.calls += 1
+        return word
+
+    def as_dict(self):
+        stats = {
+            'stages': {name: getattr(self, name).as_dict()
+                       for name in ('select', 'run_rule', 'assimilate', 'filters')},
+            'steps': [step.as_dict() for step in self.steps],
+            'generate': {'calls': self.generated, 'draws': self.draws, 'accepted': self.accepted,
+                         'duplicates': self.duplicates, 'rejected': self.rejected},
+        }
+        if self.filter_cache is not None:
+            stats['filter_cache'] = {'hits': self.filter_cache.hits,
+                                     'misses': self.filter_cache.misses,
+                                     'on': self.filter_cache.on}
+        return stats
+
+    def report(self, top=5):
+        """The stats as text, for people: stages, then filter steps,
+        with the top filters of each by what they did."""
+        lines = ['%-28s %10s %12s %10s' % ('stage', 'calls', 'seconds', 'us/call')]
+        for name in ('select', 'run_rule', 'assimilate', 'filters'):
+            stage = getattr(self, name)
+            lines.append('%-28s %10d %12.4f %10.2f' % (
+                name, stage.calls, stage.seconds, 1e6 * stage.seconds / stage.calls if stage.calls else 0))
+        if self.filter_cache is not None:
+            cache = self.filter_cache
+            lines.append('filter cache: %d hits, %d misses%s' % (
+                cache.hits, cache.misses, '' if cache.on else ' (off)'))
+        lines.append('')
+        lines.append('%-28s %10s %12s %10s %10s' % ('filter step', 'words', 'seconds', 'changed', 'rejected'))
+        for step in self.steps:
+            lines.append('%-28s %10d %12.4f %10d %10d' % (
+                step.label()[:28], step.calls, step.seconds, step.changed, step.rejected))
+            if len(step.filters) > 1:
+                busiest = sorted(step.counts.items(), key=lambda item: -sum(item[1]))
+                for (filt, (hits, rejected)) in busiest[:top]:
+                    if hits or rejected:
+                        lines.append('  %-26s %10s %12s %10d %10d' % (describe(filt)[:26], '', '', hits, rejected))
+        if self.generated:
+            lines.append('')
+            lines.append('generate: %d draws, %d accepted, %d repeats, %d rejected' % (
+                self.draws, self.accepted, self.duplicates, self.rejected))
+        return '\n'.join(lines)
+
+
+class ProfiledChain:
+    """A FilterChain that gives the same answers, timing and counting
+    each step as it goes."""
+
+    def __init__(self, chain, stats):
+        self.stats = stats
+        self.chain = chain
+        self.filters = chain.filters
+        self.deterministic = chain.deterministic
+        stats.steps = [StepStats(apply.__self__) for (apply, check) in chain.steps]
+        self.steps = [(apply, step) for ((apply, check), step) in zip(chain.steps, stats.steps)]
+
+    def __len__(self):
+        return len(self.chain)
+
+    def leading_rejects(self):
+        return self.chain.leading_rejects()
+
+    # The real chain only looks for 'REJECT' at some steps; once it
+    # appears it stays until then, so looking after every step gives
+    # the same answer, and shows which step it was.
+    def __call__(self, word):
+        clock = time.perf_counter
+        for (apply, step) in self.steps:
+            start = clock()
+            after = apply(word)
+            step.seconds += clock() - start
+            step.calls += 1
+            if 'REJECT' in after:
+                if 'REJECT' not in word:
+                    step.rejected += 1
+                    self.blame(step, word, 'REJECT')
+                return 'REJECT'
+            if after != word:
+                step.changed += 1
+                self.blame(step, word, after)
+            word = after
+        return word
+
+    def blame(self, step, before, after):
+        start = time.perf_counter()
+        step.blame(before, after)
+        self.stats.blaming += time.perf_counter() - start
@@ -0,0 +1,96 @@
+"""Word generation spread over several processes.
+
+The sound system is pickled and sent to each worker process once,
+when the pool starts.  Work is handed out in rounds: every worker
+makes its share of the draws, with the random module seeded from the
+master seed, the round and the worker's number, and the results are
+merged in worker order.  So the same seed and number of workers
+always gives the same words, however the processes happen to be
+scheduled.
+
+Workers send back every word that got through the filters, repeats
+and all, so that one saturation.WordTally over all of them can tell
+when the language is used up, just as for a single process.  A
+language small enough to list is drawn from without starting a pool.
+"""
+import os
+import pickle
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import saturation
+import wordspace
+from codes import WordCode
+
+sound_system = None  # the worker's copy
+MIN_QUOTA = 100  # fewest draws asked of a worker in a round
+
+
+def start_worker(pickled):
+    global sound_system
+    # Unpickling sets up the feature tables too (see
+    # SoundSystem.__setstate__), which a spawned worker starts without.
+    sound_system = pickle.loads(pickled)
+
+
+def make_words(task):
+    """The filtered words from draws runs of the rules, repeats and
+    all, and how many were rejected."""
+    (seed, draws) = task
+    random.seed(seed)
+    make_raw = sound_system.raw_word_maker()
+    apply_filters = sound_system.apply_filters
+    words = [apply_filters(make_raw()) for i in range(draws)]
+    passed = [word for word in words if word != 'REJECT']
+    return (passed, len(words) - len(passed))
+
+
+def generate(ss, n=10, unsorted=False, workers=None, seed=None):
+    """Generate n unique words with a pool of worker processes."""
+    global sound_system
+    workers = workers or os.cpu_count() or 1
+    if seed is None:
+        seed = random.getrandbits(64)
+    ways = ss.count_possible()
+    if ways <= wordspace.SMALL_LANGUAGE and n * 2 >= ways:
+        # Listing the language is quicker than starting a pool.
+        return ss.generate_list(n, unsorted, seed).words
+    tally = saturation.WordTally(ways)
+    words = []
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(workers, initializer=start_worker,
+                                   initargs=(pickle.dumps(ss),))
+    else:
+        sound_system = ss
+    try:
+        rnd = 0
+        draws = max(-(-n // workers), MIN_QUOTA)
+        while len(words) < n:
+            tasks = [('%s/%d/%d' % (seed, rnd, w), draws) for w in range(workers)]
+            results = pool.map(make_words, tasks) if pool else map(make_words, tasks)
+            before = len(words)
+            for (passed, rejected) in results:
+                for word in passed:
+                    if tally.add(word) is WordCode.ACCEPT:
+                        words.append(word)
+                for i in range(rejected):
+                    tally.add('REJECT')
+            if len(words) >= n or tally.exhausted():
+                break
+            # Enough draws for the words still wanted at the rate new
+            # ones turned up this round, but at most twice as many.
+            found = len(words) - before
+            if found:
+                needed = -(-(n - len(words)) * draws // found)
+                draws = max(MIN_QUOTA, min(2 * draws, needed))
+            else:
+                draws *= 2
+            rnd += 1
+    finally:
+        if pool:
+            pool.shutdown()
+    words = words[:n]
+    if not unsorted:
+        words = ss.sort_words(words)
+    return words
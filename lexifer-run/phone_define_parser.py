@@ -58,6 +58,8 @@ class PhonologyDefinition(object):
                 else:
                     raise ParseError(line)
                 line = f.readline()
+        self.sound_system.check_rules()
+        self.sound_system.compile_filters()
         # A non-fatal bit of sanity checking and warning.
         if (self.sound_system.use_assim or self.sound_system.use_coronal_metathesis) and self.sound_system.sorter is None:
             sys.stderr.write("Without 'letters:' cannot apply assimilations or coronal metathesis.\n\n")
@@ -76,6 +78,12 @@ class PhonologyDefinition(object):
                 self.sound_system.with_std_assimilations()
             elif option == 'coronal-metathesis':
                 self.sound_system.with_coronal_metathesis()
+            elif option == 'alias-sampling':
+                self.sound_system.use_alias_sampling()
+            elif option == 'constrained-sampling':
+                self.sound_system.use_constrained_sampling()
+            elif option == 'uca-sort':
+                self.sound_system.use_uca_sort()
             else:
                 raise UnknownOption(option)    
 
@@ -157,6 +165,7 @@ class PhonologyDefinition(object):
 
     def parse_random_rate(self, line):
         self.sound_system.randpercent = int(line)
+        self.sound_system.sampler = None
 
     def sanity_check(self):
         # Can't do sanity checking if the letters: directive isn't used.
@@ -169,5 +178,76 @@ class PhonologyDefinition(object):
             sys.stderr.write(msg)
             sys.stderr.write("** Strange word shapes are likely to result.\n")
 
-    def generate(self, n=1, unsorted=False):
-        return self.sound_system.generate(n, unsorted)
+    def generate(self, n=1, unsorted=False, workers=None, seed=None):
+        return self.sound_system.generate(n, unsorted, workers, seed)
+
+    def generate_list(self, n=1, unsorted=False, seed=None):
+        return self.sound_system.generate_list(n, unsorted, seed)
+
+    def iter_words(self, limit=None, dedup=None, max_attempts=None):
+        return self.sound_system.iter_words(limit, dedup, max_attempts)
+
+    def iter_sorted(self, words, run_size=None, directory=None):
+        return self.sound_system.iter_sorted(words, run_size, directory)
+
+
+# Built definitions are kept in a cache directory, if one is given to
+# load(), as pickles named for a hash of the definition file, the
+# random seed and the program itself.
+CACHE_FORMAT = 1  # bump when what load() saves changes
+
+
+def load(file_name, cache_dir=None, seed=None):
+    """A PhonologyDefinition for file_name, parsed, or loaded from
+    cache_dir if it has been parsed there before.
+
+    Unweighted classes get a little random jitter when parsed, so
+    the cache is kept per seed, and with one the random state after
+    parsing is saved too: the words are the same as with no cache.
+    Without a seed, every run reuses the jitter of the first.
+    """
+    if cache_dir is None:
+        return PhonologyDefinition(file_name)
+    import hashlib
+    import os
+    import pickle
+    import random
+    with open(file_name, 'rb') as f:
+        text = f.read()
+    text += repr((CACHE_FORMAT, seed, code_version())).encode('utf-8')
+    name = hashlib.blake2b(text, digest_size=20).hexdigest() + '.pickle'
+    cache = os.path.join(cache_dir, name)
+    try:
+        with open(cache, 'rb') as f:
+            (pd, state) = pickle.load(f)
+    except Exception:
+        pass  # not there, or from something that can't load it
+    else:
+        if state is not None:
+            random.setstate(state)
+        pd.sanity_check()
+        return pd
+    pd = PhonologyDefinition(file_name)
+    state = random.getstate() if seed is not None else None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp = '{}.{}.tmp'.format(cache, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump((pd, state), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, cache)
+    except OSError:
+        pass
+    return pd
+
+
+def code_version():
+    # The Python version, and the size and time of each of our source
+    # files, so a changed program never loads an old pickle.
+    import os
+    here = os.path.dirname(os.path.realpath(__file__))
+    stats = []
+    for name in sorted(os.listdir(here)):
+        if name.endswith('.py'):
+            st = os.stat(os.path.join(here, name))
+            stats.append((name, st.st_size, st.st_mtime_ns))
+    return (sys.version, stats)
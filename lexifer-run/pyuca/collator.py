@@ -1,43 +1,119 @@
 from __future__ import unicode_literals
 
+import hashlib
+import marshal
+import os
 import os.path
 import re
+import struct
 import sys
 import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
 from io import open
 
-class Node:
-    __slots__ = ("value", "children")
+# The trie is kept in flat arrays rather than an object per node, which
+# takes a fraction of the memory and can be saved and loaded whole.
+# Node 0 is the root.  The children of node n are targets[j] for j in
+# range(first[n], first[n + 1]), ordered by their code points,
+# labels[j].  The value of node n is weights[start[n]:start[n + 1]],
+# three weights (primary, secondary, tertiary) to a collation element;
+# a node with none has no value.  Most lookups are of a single code
+# point, so the root's children below ROOT_SPAN are also in root, by
+# code point, 0 for none.
+ROOT_SPAN = 0x3400
 
-    def __init__(self):
-        self.value = None
-        self.children = None
 
 class Trie:
-    def __init__(self):
-        self.root = Node()
-
-    def add(self, key, value):
-        curr_node = self.root
-        for part in key:
-            if curr_node.children is None:
-                curr_node.children = {}
-            curr_node = curr_node.children.setdefault(part, Node())
-        curr_node.value = value
-
-    def find_prefix(self, key):
-        curr_node = self.root
-        success_index = 0
-        success_value = None
-        for i, part in enumerate(key):
-            if curr_node.children is None or part not in curr_node.children:
+    def __init__(self, first, labels, targets, start, weights):
+        self.first = first
+        self.labels = labels
+        self.targets = targets
+        self.start = start
+        self.weights = weights
+        self.root = array("I", bytes(4 * ROOT_SPAN))
+        for j in range(first[0], first[1]):
+            if labels[j] < ROOT_SPAN:
+                self.root[labels[j]] = targets[j]
+
+    @classmethod
+    def build(cls, entries):
+        """A trie of entries, a dict of code point tuples to lists of
+        collation elements."""
+        root = [None, {}]
+        for key, value in entries.items():
+            node = root
+            for part in key:
+                node = node[1].setdefault(part, [None, {}])
+            node[0] = value
+        first, labels, targets = array("I"), array("I"), array("I")
+        start, weights = array("I"), array("H")
+        # Breadth first, so a node's children get consecutive numbers.
+        order = [root]
+        for node in order:
+            first.append(len(labels))
+            start.append(len(weights))
+            for element in node[0] or ():
+                weights.extend(element[:3])
+            for part in sorted(node[1]):
+                labels.append(part)
+                targets.append(len(order))
+                order.append(node[1][part])
+        first.append(len(labels))
+        start.append(len(weights))
+        return cls(first, labels, targets, start, weights)
+
+    def dumps(self):
+        return marshal.dumps(tuple(a.tobytes() for a in
+            (self.first, self.labels, self.targets, self.start, self.weights)))
+
+    @classmethod
+    def loads(cls, data):
+        arrays = []
+        for code, raw in zip("IIIIH", marshal.loads(data)):
+            a = array(code)
+            a.frombytes(raw)
+            arrays.append(a)
+        return cls(*arrays)
+
+    def child(self, node, part):
+        """The child of node for code point part, or None."""
+        lo, hi = self.first[node], self.first[node + 1]
+        j = bisect_left(self.labels, part, lo, hi)
+        if j < hi and self.labels[j] == part:
+            return self.targets[j]
+        return None
+
+    def has_value(self, node):
+        return self.start[node] != self.start[node + 1]
+
+    def find_prefix(self, key, pos=0):
+        """The longest run of key from pos that has a value: (end, node)
+        with key[pos:end] the run, or (pos, 0) if there is none."""
+        first, labels, targets, start = self.first, self.labels, self.targets, self.start
+        part = key[pos]
+        if part < len(self.root):
+            node = self.root[part]
+        else:
+            node = self.child(0, part) or 0
+        if not node:
+            return (pos, 0)
+        found = (pos + 1, node) if start[node] != start[node + 1] else (pos, 0)
+        for i in range(pos + 1, len(key)):
+            lo, hi = first[node], first[node + 1]
+            if lo == hi:
+                break
+            part = key[i]
+            j = bisect_left(labels, part, lo, hi)
+            if j == hi or labels[j] != part:
                 break
-            curr_node = curr_node.children[part]
-            if curr_node.value:
-                success_index = i + 1
-                success_value = curr_node.value
-        return key[:success_index], success_value, key[success_index:]
-    
+            node = targets[j]
+            if start[node] != start[node + 1]:
+                found = (i + 1, node)
+        return found
+
+
 def hexstrings2int(hexstrings):
     """
     list of hex strings to list of integers
@@ -49,6 +125,24 @@ def hexstrings2int(hexstrings):
 
 
 
+CACHE_FORMAT = 2  # bump when what load() saves changes
+KEY_CACHE_SIZE = 100000  # strings whose keys sort_keys() remembers
+
+
+def cache_name(filename, text):
+    """Where the parsed form of the table in filename is kept: named
+    for the hash of the text, and of the marshal format it is in."""
+    version = "{0}.{1}".format(CACHE_FORMAT, marshal.version)
+    digest = hashlib.sha1(text + version.encode("ascii")).hexdigest()
+    return "{0}.{1}.marshal".format(os.path.splitext(filename)[0], digest[:16])
+
+
+def pack_key(key):
+    """A sort key as big-endian 16-bit weights: bytes compare just as
+    the tuple of weights does."""
+    return struct.pack(">%dH" % len(key), *key)
+
+
 COLL_ELEMENT_PATTERN = re.compile(r"""
     \[
     (?:\*|\.)
@@ -77,64 +171,124 @@ class BaseCollator(object):
             filename = os.path.join(
                 os.path.dirname(__file__),
                 "allkeys-{0}.txt".format(self.UCA_VERSION))
-        self.table = Trie()
+        self.table = None
         self.implicit_weights = []
         self.load(filename)
+        self.singles = self.single_weights()
+        self.key_cache = OrderedDict()
+        self.key_cache_size = KEY_CACHE_SIZE
 
     def load(self, filename):
-        with open(filename) as keys_file:
-            for line in keys_file:
-                line = line.split("#", 1)[0].rstrip()
-
-                if not line or line.startswith("@version"):
-                    continue
-
-                if line.startswith("@implicitweights"):
-                    ch_range, base = line[len("@implicitweights"):].split(";")
-                    range_start, range_end = ch_range.split("..")
-                    self.implicit_weights.append([
-                        int(range_start, 16), int(range_end, 16), int(base, 16)
-                    ])
-                    continue
-
-                a, b = line.split(";", 1)
-                char_list = hexstrings2int(a.split())
-                coll_elements = []
-                for x in COLL_ELEMENT_PATTERN.finditer(b.strip()):
-                    weights = x.groups()
-                    coll_elements.append(hexstrings2int(weights))
-                self.table.add(char_list, coll_elements)
+        # Parsing the table is most of the time it takes to start up, so
+        # the parsed table is kept next to it (see cache_name()) and
+        # reused for as long as the text doesn't change.
+        with open(filename, "rb") as keys_file:
+            text = keys_file.read()
+        cache = cache_name(filename, text)
+        try:
+            with open(cache, "rb") as cache_file:
+                table, self.implicit_weights = marshal.loads(cache_file.read())
+            self.table = Trie.loads(table)
+            return
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+        self.parse(text.decode("utf-8").splitlines())
+        try:
+            temp = "{0}.{1}.tmp".format(cache, os.getpid())
+            with open(temp, "wb") as cache_file:
+                cache_file.write(marshal.dumps((self.table.dumps(), self.implicit_weights)))
+            os.replace(temp, cache)
+        except OSError:
+            pass  # e.g. a read-only install; parse every time then
+
+    def parse(self, lines):
+        entries = {}
+        for line in lines:
+            line = line.split("#", 1)[0].rstrip()
+
+            if not line or line.startswith("@version"):
+                continue
+
+            if line.startswith("@implicitweights"):
+                ch_range, base = line[len("@implicitweights"):].split(";")
+                range_start, range_end = ch_range.split("..")
+                self.implicit_weights.append([
+                    int(range_start, 16), int(range_end, 16), int(base, 16)
+                ])
+                continue
+
+            a, b = line.split(";", 1)
+            char_list = hexstrings2int(a.split())
+            coll_elements = []
+            for x in COLL_ELEMENT_PATTERN.finditer(b.strip()):
+                weights = x.groups()
+                coll_elements.append(hexstrings2int(weights))
+            entries[tuple(char_list)] = coll_elements
+        self.table = Trie.build(entries)
+
+    def single_weights(self):
+        """The weights of every code point that is an entry of its own
+        and starts no longer one, so can be looked up on its own with
+        no contractions or non-starters to worry about."""
+        table = self.table
+        singles = {}
+        for j in range(table.first[0], table.first[1]):
+            node = table.targets[j]
+            if table.first[node] == table.first[node + 1] and table.has_value(node):
+                singles[table.labels[j]] = tuple(
+                    table.weights[table.start[node]:table.start[node + 1]])
+        return singles
 
     def collation_elements(self, normalized_string):
-        collation_elements = []
-
-        lookup_key = self.build_lookup_key(normalized_string)
-        while lookup_key:
-            S, value, lookup_key = self.table.find_prefix(lookup_key)
+        weights = self.weights(normalized_string)
+        return [list(weights[i:i + 3]) for i in range(0, len(weights), 3)]
 
-            # handle non-starters
-
-            last_class = None
-            for i, C in enumerate(lookup_key):
-                combining_class = unicodedata.combining(chr(C))
-                if combining_class == 0 or combining_class == last_class:
-                    break
-                last_class = combining_class
-                # C is a non-starter that is not blocked from S
-                x, y, z = self.table.find_prefix(S + [C])
-                if z == [] and y is not None:
-                    lookup_key = lookup_key[:i] + lookup_key[i + 1:]
-                    value = y
-                    break  # ???
+    def weights(self, normalized_string):
+        """The collation elements of a string, flattened to one list
+        of weights, three to an element."""
+        table = self.table
+        singles, start, values = self.singles, table.start, table.weights
+        weights = []
 
-            if not value:
-
-                codepoint = lookup_key.pop(0)
-                value = self.implicit_weight(codepoint)
-
-            collation_elements.extend(value)
-
-        return collation_elements
+        lookup_key = self.build_lookup_key(normalized_string)
+        length = len(lookup_key)
+        pos = 0
+        while pos < length:
+            cp = lookup_key[pos]
+            single = singles.get(cp)
+            if single is not None:
+                weights.extend(single)
+                pos += 1
+                continue
+            end, node = table.find_prefix(lookup_key, pos)
+
+            # handle non-starters (usually there is none to handle)
+
+            if end < length and unicodedata.combining(chr(lookup_key[end])):
+                last_class = None
+                for i in range(end, length):
+                    C = lookup_key[i]
+                    combining_class = unicodedata.combining(chr(C))
+                    if combining_class == 0 or combining_class == last_class:
+                        break
+                    last_class = combining_class
+                    # C is a non-starter that is not blocked from S
+                    extended = table.child(node, C)
+                    if extended is not None and table.has_value(extended):
+                        del lookup_key[i]
+                        length -= 1
+                        node = extended
+                        break  # ???
+
+            if node:
+                weights.extend(values[start[node]:start[node + 1]])
+                pos = end
+            else:
+                for element in self.implicit_weight(cp):
+                    weights.extend(element)
+                pos += 1
+
+        return weights
 
     def sort_key_from_collation_elements(self, collation_elements):
         sort_key = []
@@ -151,9 +305,40 @@ class BaseCollator(object):
         return tuple(sort_key)
 
     def sort_key(self, string):
-        normalized_string = unicodedata.normalize("NFD", string)
-        collation_elements = self.collation_elements(normalized_string)
-        return self.sort_key_from_collation_elements(collation_elements)
+        # sort_key_from_collation_elements(), straight from the weights,
+        # with a 0 after each level.
+        weights = self.weights(unicodedata.normalize("NFD", string))
+        return (*filter(None, weights[0::3]), 0,
+                *filter(None, weights[1::3]), 0,
+                *filter(None, weights[2::3]), 0)
+
+    def sort_keys(self, strings, bytes_keys=False):
+        """sort_key() of each of strings, as a list.  The keys of the
+        last key_cache_size strings are remembered, so a string that
+        comes up again costs a dict lookup.
+
+        With bytes_keys, each key is packed into bytes, two to a weight,
+        which compare the same way as the tuples but more cheaply, and
+        take less room.
+        """
+        cache = self.key_cache
+        keys = []
+        for string in strings:
+            key = cache.get(string)
+            if key is None:
+                key = cache[string] = self.sort_key(string)
+                if len(cache) > self.key_cache_size:
+                    cache.popitem(last=False)
+            else:
+                cache.move_to_end(string)
+            keys.append(pack_key(key) if bytes_keys else key)
+        return keys
+
+    # The key cache goes along empty, e.g. to another process.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["key_cache"] = OrderedDict()
+        return state
 
     def implicit_weight(self, cp):
         if (
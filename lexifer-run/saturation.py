@@ -0,0 +1,210 @@
+"""Knowing when a language has run out of new words.
+
+SoundSystem.generate() used to give up after n * 3 words whatever the
+size of the language, which was too soon for a big one with a lot of
+repeats and too late for a tiny one.  A WordTally keeps count of every
+word made so far, and from how many were seen exactly once and exactly
+twice estimates how many are still to be found (Chao's estimator, as
+used for counting species from capture-recapture samples).  When fewer
+than one is expected, and nothing new has turned up for a good while,
+the language is taken to be used up.
+
+Until some word gets through the filters there is nothing to estimate
+from.  With no bound on the number of words, generation gives up after
+ALL_REJECTED draws in a row are rejected; with one, after ALL_REJECTED
+for every way the rules can run, up to MAX_WAYS_REJECTED ways.  So a
+small language that rejects nearly everything still gets its few
+words, and one whose filters reject everything still comes to an end.
+
+No estimate can know about words too rare to have been seen at all,
+so the quiet spell has to be at least as long as everything before
+it, and at least MIN_STALE words.  When the number of ways the rules
+can run is known, reaching it stops generation straight away.
+
+Some languages are never quite used up: a long tail of rare words
+keeps turning up, one every few thousand tries.  The chance that the
+next word is new is about the number of words seen once over the
+number of tries (Good and Turing's estimate), and once that is below
+one in MAX_TRIES_PER_WORD, generation stops there too.
+
+A StreamTally is for words too many to remember (see
+SoundSystem.iter_words()): it keeps only the totals, so with no
+estimate to go on it waits for the quiet spell alone.
+"""
+from codes import WordCode, WordListCode
+
+MIN_STALE = 1000           # words in a row with nothing new, at the least
+MAX_TRIES_PER_WORD = 1000  # the most words worth making per new one
+ALL_REJECTED = 1000        # draws, all rejected, before giving up (per way, with a bound)
+MAX_WAYS_REJECTED = 100    # most ways counted towards that
+
+
+class StreamTally:
+    """The totals of a WordTally without the words themselves, which
+    a dedup (see dedup.py) keeps instead."""
+
+    def __init__(self, bound=None):
+        self.bound = bound   # most different words there can be
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.last_new = 0    # tries when the last new word turned up
+
+    def add(self, word, new):
+        """Count a word fresh from the filters, and whether it was
+        new, as told by a dedup.  Says what it was."""
+        if word == 'REJECT':
+            self.rejected += 1
+            return WordCode.REJECT
+        if new:
+            self.accepted += 1
+            self.last_new = self.tries
+            return WordCode.ACCEPT
+        self.duplicates += 1
+        return WordCode.DUPLICATE
+
+    @property
+    def tries(self):
+        # Words that got through the filters, repeats and all.
+        return self.accepted + self.duplicates
+
+    @property
+    def draws(self):
+        return self.tries + self.rejected
+
+    def duplicate_rate(self):
+        return self.duplicates / self.tries if self.tries else 0.0
+
+    def reject_rate(self):
+        return self.rejected / self.draws if self.draws else 0.0
+
+    def exhausted(self):
+        """Whether there is likely nothing new left to find."""
+        if self.bound is not None and self.accepted >= self.bound:
+            return True
+        if self.tries == 0:
+            return self.all_rejected()
+        return self.quiet()
+
+    def none_pass(self):
+        """Whether every word so far has been rejected, for long
+        enough to stop looking."""
+        return self.tries == 0 and self.all_rejected()
+
+    def all_rejected(self):
+        # Nothing through the filters yet.  A language where only one
+        # raw word in thousands passes is slow, not used up, so with a
+        # bound the draws it takes grow with it.
+        if self.bound is None:
+            return self.rejected >= ALL_REJECTED
+        return self.rejected >= ALL_REJECTED * min(self.bound, MAX_WAYS_REJECTED)
+
+    def quiet(self):
+        # Nothing new for as long as it took to find everything so far.
+        return self.tries - self.last_new >= max(MIN_STALE, self.last_new)
+
+
+class WordTally(StreamTally):
+    def __init__(self, bound=None):
+        super().__init__(bound)
+        self.counts = {}
+        self.singletons = 0  # words seen exactly once
+        self.doubletons = 0  # words seen exactly twice
+        self.total = None    # different words there are, when known
+
+    def add(self, word):
+        """Count a word fresh from the filters, and say what it was."""
+        if word == 'REJECT':
+            self.rejected += 1
+            return WordCode.REJECT
+        seen = self.counts.get(word, 0)
+        self.counts[word] = seen + 1
+        if seen == 0:
+            self.accepted += 1
+            self.singletons += 1
+            self.last_new = self.tries
+            return WordCode.ACCEPT
+        self.duplicates += 1
+        if seen == 1:
+            self.singletons -= 1
+            self.doubletons += 1
+        elif seen == 2:
+            self.doubletons -= 1
+        return WordCode.DUPLICATE
+
+    def unseen(self):
+        """Estimated number of words not seen yet (bias-corrected Chao1)."""
+        f1 = self.singletons
+        return f1 * (f1 - 1) / (2 * (self.doubletons + 1))
+
+    def estimated_total(self):
+        if self.total is not None:
+            return self.total
+        return self.accepted + self.unseen()
+
+    def exhausted(self):
+        """Whether there is likely nothing new left to find."""
+        if self.bound is not None and self.accepted >= self.bound:
+            return True
+        if self.tries == 0:
+            return self.all_rejected()
+        if self.tries >= MAX_TRIES_PER_WORD * (self.singletons + 1):
+            return True
+        return self.quiet() and self.unseen() < 0.5
+
+
+class WordList:
+    """The words from SoundSystem.generate_list(), with how it went.
+
+    status is WordListCode.SUCCESS if all the words asked for were
+    made, or WordListCode.FAIL if the language ran out first.
+    """
+
+    def __init__(self, words, status, tally):
+        self.words = words
+        self.status = status
+        self.tally = tally
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __len__(self):
+        return len(self.words)
+
+    def stats(self):
+        tally = self.tally
+        return {
+            'words': len(self.words),
+            'draws': tally.draws,
+            'accepted': tally.accepted,
+            'duplicates': tally.duplicates,
+            'rejected': tally.rejected,
+            'duplicate_rate': tally.duplicate_rate(),
+            'reject_rate': tally.reject_rate(),
+            'estimated_total': tally.estimated_total(),
+        }
+
+
+def drawn(words, n, total):
+    """A WordList for words drawn without replacement from all total
+    words there are, so with no repeats."""
+    tally = WordTally()
+    for word in words:
+        tally.add(word)
+    tally.total = total
+    status = WordListCode.SUCCESS if len(words) >= n else WordListCode.FAIL
+    return WordList(words, status, tally)
+
+
+def collect(make_word, n, bound=None):
+    """Call make_word() until n different words are made or the
+    language is used up."""
+    tally = WordTally(bound)
+    words = []
+    while len(words) < n:
+        word = make_word()
+        if tally.add(word) is WordCode.ACCEPT:
+            words.append(word)
+        if len(words) < n and tally.exhausted():
+            return WordList(words, WordListCode.FAIL, tally)
+    return WordList(words, WordListCode.SUCCESS, tally)
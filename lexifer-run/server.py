@@ -0,0 +1,285 @@
+"""A long-running generator, for other programs to call.
+
+Requests come in on stdin and answers go out on stdout, one JSON
+object per line (newline-delimited JSON), so a caller pays for
+starting Python, loading the collation table and parsing a definition
+once rather than on every call.  A request is an object such as
+
+    {"id": 1, "op": "generate", "file": "examples/anng.def", "n": 20, "seed": 7}
+    {"id": 2, "op": "textify", "file": "examples/anng.def", "sentences": 5}
+    {"id": 3, "op": "stats"}
+
+and the answer carries the same id, with "ok": true and "words",
+"text" or "stats", or "ok": false and an "error".  Other fields:
+"unsorted" for generate, and "timeout" in seconds for either.
+
+Parsed definitions are kept, most recently used first, for as long as
+their file's modification time stays the same.  They are parsed with
+the random module seeded by PARSE_SEED, so a request with a seed gets
+the same words from any server (though not the same as the command
+line with --seed, which seeds the parse with it too).
+
+The random module and the assimilation tables are global, so requests
+are served one at a time, in the order they come.  At most max_pending
+may be waiting or running; any more are turned away at once with a
+"busy" error.  A stats request is answered as soon as it is read.  A
+request that isn't done within its timeout is given up with a "timed
+out" error, and the definition it was using is parsed again next
+time, in case it was left half way through something.  (Where there
+is no SIGALRM, as on Windows, only time spent waiting counts.)  For
+more than one request at a time, start more servers.
+"""
+import json
+import os
+import queue
+import random
+import signal
+import threading
+import time
+from collections import OrderedDict, deque
+
+import phone_define_parser
+import smart_clusters as sc
+from wordgen import textify
+
+CACHE_SIZE = 16      # parsed definitions kept
+MAX_PENDING = 64     # requests waiting or running at once
+TIMEOUT = 30.0       # seconds, unless the request says otherwise
+LATENCIES = 1000     # latest request times kept for the percentiles
+PARSE_SEED = 0
+MAX_WORDS = 1000000  # largest n a request may ask for
+MAX_SENTENCES = 1000
+
+
+class RequestError(Exception): pass
+
+# Raised from a signal handler anywhere in a request, so it mustn't be
+# something that an "except Exception" on the way could swallow.
+class Timeout(BaseException): pass
+
+
+class DefinitionCache:
+    """Parsed PhonologyDefinitions by file name, least recently used
+    dropped first, and parsed again when the file changes."""
+
+    def __init__(self, maxsize=CACHE_SIZE, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()  # path -> (mtime, definition)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        path = os.path.realpath(path)
+        mtime = os.stat(path).st_mtime_ns
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == mtime:
+            self.hits += 1
+            self.entries.move_to_end(path)
+            return entry[1]
+        self.misses += 1
+        random.seed(PARSE_SEED)
+        pd = phone_define_parser.load(path, self.cache_dir, PARSE_SEED)
+        self.entries[path] = (mtime, pd)
+        self.entries.move_to_end(path)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return pd
+
+    def drop(self, path):
+        self.entries.pop(os.path.realpath(path), None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def percentile(ordered, p):
+    """The p'th percentile (nearest rank) of a sorted list."""
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class Server:
+    def __init__(self, resolve=None, cache_dir=None, max_pending=MAX_PENDING,
+                 timeout=TIMEOUT, cache_size=CACHE_SIZE):
+        self.resolve = resolve or (lambda file_name: file_name)
+        self.definitions = DefinitionCache(cache_size, cache_dir)
+        self.timeout = timeout
+        self.features = None  # what the assimilation tables are set up for
+        self.pending = queue.Queue()
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.output_lock = threading.Lock()
+        # Each count is only ever changed by one of the two threads.
+        self.counts = {}
+        self.errors = 0
+        self.timeouts = 0
+        self.answered = 0
+        self.taken = 0
+        self.bad = 0
+        self.busy = 0
+        self.latencies = deque(maxlen=LATENCIES)
+        self.started = time.monotonic()
+
+    def serve(self, infile, outfile):
+        """Answer requests from infile until it ends."""
+        self.outfile = outfile
+        reader = threading.Thread(target=self.read, args=(infile,), daemon=True)
+        reader.start()
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            (request, received) = item
+            try:
+                self.answer(request, received)
+            finally:
+                self.slots.release()
+
+    # Reading is done by a thread of its own, so a full queue can be
+    # refused straight away while a request is running.
+    def read(self, infile):
+        try:
+            for line in infile:
+                if not line.strip():
+                    continue
+                received = time.monotonic()
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('a request must be a JSON object')
+                except ValueError as e:
+                    self.bad += 1
+                    self.write({'id': None, 'ok': False, 'error': 'bad request: {}'.format(e)})
+                    continue
+                if request.get('op') == 'stats':
+                    # Answered straight away, busy or not.
+                    self.write({'id': request.get('id'), 'stats': self.stats(), 'ok': True})
+                    continue
+                if not self.slots.acquire(blocking=False):
+                    self.busy += 1
+                    self.write({'id': request.get('id'), 'ok': False, 'error': 'busy'})
+                    continue
+                self.taken += 1
+                self.pending.put((request, received))
+        finally:
+            self.pending.put(None)
+
+    def write(self, response):
+        with self.output_lock:
+            self.outfile.write(json.dumps(response, ensure_ascii=False) + '\n')
+            self.outfile.flush()
+
+    def answer(self, request, received):
+        op = request.get('op')
+        response = {'id': request.get('id')}
+        try:
+            timeout = float(request.get('timeout', self.timeout))
+            left = timeout - (time.monotonic() - received)
+            if left <= 0:
+                raise Timeout()
+            with deadline(left):
+                response.update(self.handle(op, request))
+            response['ok'] = True
+        except Timeout:
+            self.timeouts += 1
+            if request.get('file'):
+                self.definitions.drop(self.resolve(str(request['file'])))
+            response.update(ok=False, error='timed out')
+        except (RequestError, ValueError, TypeError, OSError,
+                phone_define_parser.ParseError, phone_define_parser.UnknownOption) as e:
+            # UnknownLetterError is a ValueError.
+            self.errors += 1
+            response.update(ok=False, error=str(e) or type(e).__name__)
+        except Exception as e:
+            self.errors += 1
+            response.update(ok=False, error='{}: {}'.format(type(e).__name__, e))
+        self.counts[op] = self.counts.get(op, 0) + 1
+        self.latencies.append(time.monotonic() - received)
+        self.answered += 1
+        self.write(response)
+
+    def handle(self, op, request):
+        if op not in ('generate', 'textify'):
+            raise RequestError('unknown op: {!r}'.format(op))
+        if 'file' not in request:
+            raise RequestError('no definition file given')
+        pd = self.definition(str(request['file']))
+        seed = request.get('seed')
+        if seed is not None:
+            random.seed(int(seed))
+        if op == 'generate':
+            n = int(request.get('n', 10))
+            if not 0 <= n <= MAX_WORDS:
+                raise RequestError('n must be between 0 and {}'.format(MAX_WORDS))
+            return {'words': pd.generate(n, bool(request.get('unsorted')))}
+        sentences = int(request.get('sentences', 25))
+        if not 0 <= sentences <= MAX_SENTENCES:
+            raise RequestError('sentences must be between 0 and {}'.format(MAX_SENTENCES))
+        return {'text': textify(pd.sound_system, sentences)}
+
+    def definition(self, file_name):
+        misses = self.definitions.misses
+        try:
+            pd = self.definitions.get(self.resolve(file_name))
+        finally:
+            # Parsing sets up the assimilation tables for itself.
+            if self.definitions.misses != misses:
+                self.features = None
+        features = pd.sound_system.features
+        if features is not None and features != self.features:
+            sc.initialize(features)
+            self.features = features
+        return pd
+
+    def stats(self):
+        ordered = [round(seconds * 1000.0, 3) for seconds in sorted(self.latencies)]
+        return {
+            'requests': dict(self.counts),
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'bad_requests': self.bad,
+            'busy': self.busy,
+            'in_flight': self.taken - self.answered,
+            'uptime': time.monotonic() - self.started,
+            'definitions': {'cached': len(self.definitions),
+                            'hits': self.definitions.hits,
+                            'misses': self.definitions.misses},
+            # In milliseconds, over the latest LATENCIES requests,
+            # waiting time included.
+            'latency_ms': {'p50': percentile(ordered, 50), 'p90': percentile(ordered, 90),
+                           'p99': percentile(ordered, 99), 'max': percentile(ordered, 100)},
+        }
+
+
+class deadline:
+    """Raise Timeout in the main thread if the block takes longer
+    than seconds."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.usable = (hasattr(signal, 'setitimer')
+                       and threading.current_thread() is threading.main_thread())
+
+    def expired(self, signum, frame):
+        raise Timeout()
+
+    def __enter__(self):
+        if self.usable:
+            self.previous = signal.signal(signal.SIGALRM, self.expired)
+            signal.setitimer(signal.ITIMER_REAL, self.seconds)
+        return self
+
+    def __exit__(self, *exc):
+        if self.usable:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous)
+        return False
+
+
+def serve(resolve=None, cache_dir=None, max_pending=MAX_PENDING, timeout=TIMEOUT):
+    """Serve requests on stdin and stdout until stdin closes."""
+    infile = open(0, 'r', encoding='utf-8', closefd=False)
+    outfile = open(1, 'w', encoding='utf-8', closefd=False)
+    Server(resolve, cache_dir, max_pending, timeout).serve(infile, outfile)
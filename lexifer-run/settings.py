@@ -2,5 +2,13 @@ ARGUMENTS = {
     'filename': 'examples/anng.def',  # Phonology definition file
     'number': '240',  # How many words to generate, default prints a paragraph
     'one_per_line': '',  # Print one word per line, default max 70 chars a line
-    'unsorted': 'y'  # Print out words unsorted, default sorted alphabetically
+    'unsorted': 'y',  # Print out words unsorted, default sorted alphabetically
+    'stream': '',  # Write words one per line as they are made, sorting on disk
+    'workers': '',  # Generate with this many processes, default one
+    'seed': '',  # Random seed, for the same words every run
+    'cache': '',  # Keep built definitions in this directory, to skip parsing next time
+    'profile': '',  # Report where the time went on stderr afterwards
+    'serve': '',  # Answer JSON requests on stdin instead, one per line
+    'timeout': '',  # Seconds a request may take when serving, default 30
+    'pending': ''  # Requests that may wait at once when serving, default 64
 }
@@ -1,7 +1,3 @@
-import sqlite3 as sql
-global phdb
-
-
 DATA = [# Bilabial, labio-dental
   ('p', 'p', 'voiceless', 'bilabial', 'stop'),
   ('b', 'b', 'voiced', 'bilabial', 'stop'),
@@ -51,64 +47,78 @@ DATA = [# Bilabial, labio-dental
   ('ɴ', 'nq', 'voiced', 'uvular', 'nasal')]
 
 
+# Everything the assimilation and metathesis rules can do is worked
+# out once, by initialize(), into tables keyed on pairs of phonemes.
+# A pair that isn't in a table is left alone.
+ASSIMILATIONS = {}  # (ph1, ph2) -> what ph1 becomes before ph2
+METATHESES = {}     # (ph1, ph2) -> (ph2, ph1)
+
+
 def initialize(notation="ipa"):
-    global phdb
-    phdb = sql.connect(':memory:')
-    c = phdb.cursor()
-    c.execute("""create table phdb
-                (phoneme text, voice text, place text, manner text)""")
     if notation == 'ipa':
-        for (ph, ignore, v, p, m) in DATA:
-            c.execute("insert into phdb values (?,?,?,?)", (ph, v, p, m))
+        table = [(ph, v, p, m) for (ph, ignore, v, p, m) in DATA]
     elif notation == 'digraph':
-        for (ignore, ph, v, p, m) in DATA:
-            c.execute("insert into phdb values (?,?,?,?)", (ph, v, p, m))
+        table = [(ph, v, p, m) for (ignore, ph, v, p, m) in DATA]
     else:
         raise Exception("Unknown notation: %s" % notation)
-    phdb.commit()
-
-def nasal_assimilate(ph1, ph2):
-    c = phdb.cursor()
-    m = c.execute("""select phoneme from phdb 
-        where (select manner from phdb where phoneme = ?) = 'nasal'
-        and manner = 'nasal'
-        and place = (select place from phdb where phoneme = ?)""", (ph1, ph2))
-    m = m.fetchall()
-    if len(m) == 0:
-        return ph1
-    else:
-        return m[0][0]
-
-def voice_assimilate(ph1, ph2):
-    c = phdb.cursor()
-    m = c.execute("""select phoneme from phdb
-        where place = (select place from phdb where phoneme = ?)
-        and manner = (select manner from phdb where phoneme = ?)
-        and (select manner from phdb where phoneme = ?) != 'nasal'
-        and voice = (select voice from phdb where phoneme = ?)
-    """, (ph1, ph1, ph2, ph2))
-    m = m.fetchall()
-    if len(m) == 0:
-        return ph1
-    else:
-        return m[0][0]
-    
+
+    # A phoneme can be listed more than once ('m' is both bilabial
+    # and labiodental).  Asking for "the" voice, place or manner of
+    # one gets the first listing.
+    first = {}
+    for (ph, v, p, m) in table:
+        first.setdefault(ph, (v, p, m))
+
+    # The first phoneme listed with given features, and the first
+    # nasal at each place.
+    by_features = {}
+    nasal_at = {}
+    for (ph, v, p, m) in table:
+        by_features.setdefault((v, p, m), ph)
+        if m == 'nasal':
+            nasal_at.setdefault(p, ph)
+    alveolar = {ph for (ph, v, p, m) in table if p == 'alveolar'}
+    swappable = {ph for (ph, v, p, m) in table
+                 if p in ('velar', 'bilabial') and m in ('stop', 'nasal')}
+
+    def voice_assimilate(ph1, ph2):
+        (v1, p1, m1) = first[ph1]
+        (v2, p2, m2) = first[ph2]
+        if m2 == 'nasal':
+            return ph1
+        return by_features.get((v2, p1, m1)) or ph1
+
+    def nasal_assimilate(ph1, ph2):
+        (v1, p1, m1) = first[ph1]
+        (v2, p2, m2) = first[ph2]
+        if m1 != 'nasal':
+            return ph1
+        return nasal_at.get(p2, ph1)
+
+    def coronal_metathesis(ph1, ph2):
+        if ph1 not in alveolar:
+            return False
+        if first[ph1][2] != first[ph2][2]:
+            return False
+        return ph2 in swappable
+
+    ASSIMILATIONS.clear()
+    METATHESES.clear()
+    for ph1 in first:
+        for ph2 in first:
+            new = nasal_assimilate(voice_assimilate(ph1, ph2), ph2)
+            if new != ph1:
+                ASSIMILATIONS[(ph1, ph2)] = new
+            if coronal_metathesis(ph1, ph2):
+                METATHESES[(ph1, ph2)] = (ph2, ph1)
+
+
+def assimilate(ph1, ph2):
+    return ASSIMILATIONS.get((ph1, ph2), ph1)
+
+
 def coronal_metathesis(ph1, ph2):
-    c = phdb.cursor()
-    m1 = c.execute("select phoneme from phdb where phoneme = ? and place = 'alveolar'", (ph1,))
-    m1 = m1.fetchall()
-    if len(m1) == 0:
-        return ph1, ph2
-    m2 = c.execute("""select phoneme from phdb
-        where phoneme = ? 
-        and place in ('velar', 'bilabial')
-        and manner in ('stop', 'nasal')
-        and (select manner from phdb where phoneme = ?) = (select manner from phdb where phoneme = ?)""", (ph2, ph2, ph1))
-    m2 = m2.fetchall()
-    if len(m2) == 0:
-        return ph1, ph2
-    else:
-        return ph2, ph1
+    return METATHESES.get((ph1, ph2), (ph1, ph2))
 
 
 # The "apply_" functions expect a word that has been split into
@@ -116,12 +126,11 @@ def coronal_metathesis(ph1, ph2):
 def apply_assimilations(word):
     new = word[:]
     for i in range(len(word) - 1):
-        new[i] = voice_assimilate(word[i], word[i+1])
-        new[i] = nasal_assimilate(new[i], word[i+1])
+        new[i] = ASSIMILATIONS.get((word[i], word[i+1]), word[i])
     return new
 #
 def apply_coronal_metathesis(word):
     new = word[:]
     for i in range(len(word) - 1):
-        new[i], new[i+1] = coronal_metathesis(word[i], word[i+1])
-    return new
\ No newline at end of file
+        new[i], new[i+1] = METATHESES.get((word[i], word[i+1]), (word[i], word[i+1]))
+    return new
@@ -1,72 +1,125 @@
 import random
-import re
 import math
-import textwrap
-import sys
+import os
 
 import smart_clusters as sc
-from distribution import WeightedSelector
+import saturation
+import wordspace
+from automaton import AhoCorasick, AssimilatedAutomaton
+from distribution import WeightedSelector, AliasSelector
+from dedup import ExactDedup, NoDedup
+from filters import FilterChain, FilterCache
 
 
 class RuleError(Exception):
     pass
 
 
+# Operations in a compiled rule, see SoundSystem.compile_rule().
+LITERAL = 0           # emit a string
+SELECT = 1            # pick from a phoneme class
+OPTIONAL = 2          # pick from a phoneme class randpercent% of the time
+OPTIONAL_LITERAL = 3  # emit a string randpercent% of the time
+DISTINCT = 4          # pick from a class, but not the sound just before
+
+
+class UnknownLetterError(ValueError):
+    """A word has a letter that isn't in the letters: order."""
+
+    def __init__(self, word, letter):
+        self.word = word
+        self.letter = letter
+        super().__init__("Word with unknown letter '%s': '%s'. "
+                         "A filter or assimilation might have caused this." % (letter, word))
+
+
 # Define an arbitrary sort order, in unicode and possibly including
-# di- or n-graphs.  It ain't efficient, but it works.
+# di- or n-graphs.
 class ArbSorter:
     def __init__(self, order):
-        self.graphs = re.split('\s*', order, flags=re.UNICODE)
-        # Create a regex to split on each character or multicharacter
-        # sort key.  (As in "ch" after all "c"s, for example.)
-        split_order = sorted(self.graphs, key=len, reverse=True)
-        split_order.append(".")
-        self.splitter = re.compile("(%s)" % "|".join(split_order), re.UNICODE)
-        # Next, collect ints for the ordering and the lookup
-        # for putting words back together.
+        self.graphs = order.split()
+        # Ints for the ordering, and the lookup for putting words
+        # back together.
         self.ords = {}
         self.vals = []
         for i in range(len(self.graphs)):
             self.ords[self.graphs[i]] = i
             self.vals.append(self.graphs[i])
+        # A trie of the graphs, one dict per node, keyed by letter.
+        # The value of a graph that ends at a node is kept under None.
+        # (As in "ch" after all "c"s, for example.)
+        self.trie = {}
+        for (graph, value) in self.ords.items():
+            node = self.trie
+            for ch in graph:
+                node = node.setdefault(ch, {})
+            node[None] = value
+        # Most letters are graphs on their own that begin no longer
+        # graph, and don't need the trie at all.
+        self.singles = {ch: node[None] for (ch, node) in self.trie.items() if list(node) == [None]}
+
+    def longest(self, word, i):
+        """(end, value) for the longest graph at word[i:].  A letter
+        in no graph stands on its own, with value None."""
+        n = len(word)
+        node = self.trie.get(word[i])
+        end = j = i + 1
+        value = None
+        while node is not None:
+            if None in node:
+                end = j
+                value = node[None]
+            if j == n:
+                break
+            node = node.get(word[j])
+            j += 1
+        return (end, value)
 
     # Turns a word into a list of ints representing the new
     # lexicographic ordering.  Python, helpfully, allows one to
     # sort ordered collections of all types, including lists.
     def word_as_values(self, word):
-        w = self.splitter.split(word)[1::2]
-        try:
-            arrayed_word = [self.ords[char] for char in w]
-        except KeyError:
-            msg = "Word with unknown letter: '%s'." % word
-            utf8stdout = open(1, 'w', encoding='utf-8', closefd=False)
-            print(msg, file=utf8stdout)
-            print("A filter or assimilation might have caused this.")
-            sys.exit(1)
-        return arrayed_word
+        singles = self.singles
+        values = []
+        i = 0
+        n = len(word)
+        while i < n:
+            value = singles.get(word[i])
+            if value is not None:
+                values.append(value)
+                i += 1
+                continue
+            (end, value) = self.longest(word, i)
+            if value is None:
+                raise UnknownLetterError(word, word[i:end])
+            values.append(value)
+            i = end
+        return values
 
     def values_as_word(self, values):
         return "".join([self.vals[v] for v in values])
 
     def split(self, word):
-        return self.splitter.split(word)[1::2]
+        """The word as a list of graphs, longest first."""
+        singles = self.singles
+        graphs = []
+        i = 0
+        n = len(word)
+        while i < n:
+            if word[i] in singles:
+                graphs.append(word[i])
+                i += 1
+            else:
+                end = self.longest(word, i)[0]
+                graphs.append(word[i:end])
+                i = end
+        return graphs
 
     def __call__(self, l):
-        l2 = [self.word_as_values(item) for item in l]
-        l2.sort()
-        return [self.values_as_word(item) for item in l2]
+        # sorted() works out each key once.
+        return sorted(l, key=self.word_as_values)
 
 
-# Weighted random selection.
-def select(dic):
-    total = sum(dic.values())
-    pick = random.uniform(0, total-1)
-    tmp = 0
-    for key, weight in dic.items():
-        tmp += weight
-        if pick < tmp:
-            return key
-
 # Give approximately natural frequencies to phonemes.
 # Gusein-Zade law.
 
@@ -103,39 +156,91 @@ class SoundSystem:
     def __init__(self):
         self.phonemeset = {}
         self.ruleset = {}
+        self.programs = {}  # rule -> compiled rule
+        self.rule_selector = None
         self.filters = []
+        self.filter_chain = None
+        self.filter_cache = FilterCache()
         self.randpercent = 10
         self.use_assim = False
         self.use_coronal_metathesis = False
         self.sorter = None
+        self.collator = None  # for Unicode collation order, see use_uca_sort()
+        self.selector = WeightedSelector
+        self.features = None  # notation for smart_clusters
+        self.constrained = False
+        self.sampler = None  # for constrained sampling, made when needed
+        self.ways = None  # count_possible(), worked out when needed
+        self.stats = None  # see enable_stats()
+
+    # smart_clusters keeps its tables at module level, so a sound system
+    # unpickled in another process has to set them up again.
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.features is not None:
+            sc.initialize(self.features)
 
     def add_ph_unit(self, name, selection):
         # add natural weights if there's no weighting.
         if ':' not in selection:
             selection = natural_weights(selection)
             # print('%s = %s' % (name, selection))
-        self.phonemeset[name] = WeightedSelector(rule2dict(selection))
+        self.phonemeset[name] = self.selector(rule2dict(selection))
+        self.recompile_rules()
+
+    # A new class can change what the rules we already have mean.
+    def recompile_rules(self):
+        for rule in self.ruleset:
+            self.programs[rule] = self.compile_rule(rule)
+        self.sampler = None
+        self.ways = None
 
     def add_rule(self, rule, weight):
-        # add rule verification
+        self.programs[rule] = self.compile_rule(rule)
         self.ruleset[rule] = weight
+        self.rule_selector = None
+        self.sampler = None
+        self.ways = None
+
+    def enable_stats(self):
+        """Start counting and timing each stage of making words, and
+        return the instrument.PipelineStats it all goes into."""
+        from instrument import PipelineStats
+        self.stats = PipelineStats(self.filter_cache)
+        self.filter_chain = None
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+        self.filter_chain = None
+
+    # Picking a rule happens once per word, so the weights are only
+    # added up again when the rules change.
+    def build_rule_selector(self):
+        self.rule_selector = self.selector(self.ruleset)
+        return self.rule_selector
+
+    def select_rules(self, k):
+        """Pick k rules at once, according to their weights."""
+        selector = self.rule_selector or self.build_rule_selector()
+        return selector.select_many(k)
 
     # rules allow phonemes to be in the rule, too: CyVN
-    def run_rule(self, rule):
-        """Generate a single instance of a rule run."""
+    def compile_rule(self, rule):
+        """Turn a rule into a list of (operation, argument) pairs."""
         n = len(rule)
-        s = []
+        program = []
         for i in range(n):
             # Skip control characters.
             if rule[i] in ['?', '!']:
                 continue
+            ph = self.phonemeset.get(rule[i])
             # Sound that occurs optionally at random.
             if i < (n-1) and rule[i+1] == '?':
-                if random.randint(0, 100) < self.randpercent:
-                    if rule[i] in self.phonemeset:  # phoneme class
-                        s.append(self.phonemeset[rule[i]].select())
-                    else:  # literal
-                        s.append(rule[i])
+                if ph is not None:  # phoneme class
+                    program.append((OPTIONAL, ph.select))
+                else:  # literal
+                    program.append((OPTIONAL_LITERAL, rule[i]))
             # Sound that must not duplicate the previous sound.
             elif i < (n-1) and i > 0 and rule[i+1] == "!":
                 # First, if the previous class was optional, we need
@@ -145,97 +250,349 @@ class SoundSystem:
                     prevc = rule[i-2]
                 else:
                     prevc = rule[i-1]
-                    #                if (rule[i] != rule[i-1]):
                 # Make sure this is even a duplicate environment.
                 if (rule[i] != prevc):
                     raise RuleError(
                         "Misplaced '!' option: in non-duplicate environment: {}.".format(rule))
-                if rule[i] in self.phonemeset:
-                    nph = self.phonemeset[rule[i]].select()
-                    while nph == s[-1]:
-                        nph = self.phonemeset[rule[i]].select()
-                    s.append(nph)
-                else:
+                # The class may not be defined yet: check_rules()
+                # looks again once they all are.
+                if ph is None:
+                    program.append((DISTINCT, None))
+                    continue
+                # Something has to be left to draw once the last
+                # sound is left out.
+                if sum(1 for weight in ph.weights if weight > 0) < 2:
                     raise RuleError(
                         "Use of '!' here makes no sense: {}".format(rule))
+                program.append((DISTINCT, ph.select_except))
             # Just a normal sound.
-            elif rule[i] in self.phonemeset:
-                s.append(self.phonemeset[rule[i]].select())
-            else:  # literal
-                s.append(rule[i])
+            elif ph is not None:
+                program.append((SELECT, ph.select))
+            # Literal, run together with any literal before it (unless
+            # a '!' will need to see the last letter on its own).
+            elif program and program[-1][0] == LITERAL and '!' not in rule:
+                program[-1] = (LITERAL, program[-1][1] + rule[i])
+            else:
+                program.append((LITERAL, rule[i]))
+        return program
+
+    def check_rules(self):
+        """Raise RuleError for a '!' on something that isn't a class,
+        which can only be told once every class is defined."""
+        for (rule, program) in self.programs.items():
+            if any(op == DISTINCT and arg is None for (op, arg) in program):
+                raise RuleError("Use of '!' here makes no sense: {}".format(rule))
+
+    def run_program(self, program):
+        s = []
+        for (op, arg) in program:
+            if op == SELECT:
+                s.append(arg())
+            elif op == LITERAL:
+                s.append(arg)
+            elif op == OPTIONAL:
+                if random.randint(0, 100) < self.randpercent:
+                    s.append(arg())
+            elif op == OPTIONAL_LITERAL:
+                if random.randint(0, 100) < self.randpercent:
+                    s.append(arg)
+            else:  # DISTINCT
+                s.append(arg(s[-1] if s else None))
         return "".join(s)
 
+    def run_rule(self, rule):
+        """Generate a single instance of a rule run."""
+        program = self.programs.get(rule)
+        if program is None:
+            program = self.compile_rule(rule)
+        return self.run_program(program)
+
     def add_filter(self, pat, repl):
         if repl == '!':
             self.filters.append((pat, ""))
         else:
             self.filters.append((pat, repl))
+        self.filter_chain = None
+        self.sampler = None
+
+    # Anything that changes what apply_filters() does to a word drops
+    # the compiled chain, so the cache starts afresh along with it.
+    # With no filters to run and nothing to assimilate, looking a word
+    # up would take longer than filtering it.
+    def compile_filters(self):
+        self.filter_chain = FilterChain(self.filters)
+        if self.stats is not None:
+            from instrument import ProfiledChain
+            self.filter_chain = ProfiledChain(self.filter_chain, self.stats)
+        busy = bool(self.filter_chain.steps) or bool(
+            self.sorter and (self.use_assim or self.use_coronal_metathesis))
+        self.filter_cache.reset(self.filter_chain.deterministic and busy)
+        return self.filter_chain
 
     def apply_filters(self, word):
+        if self.filter_chain is None:
+            self.compile_filters()
+        if self.filter_cache.on:
+            return self.filter_cache.lookup(word, self.run_filters)
+        return self.run_filters(word)
+
+    def run_filters(self, word):
+        if self.stats is not None:
+            return self.stats.run_filters(self, word)
         # First, if assimilations and metathesis are in play, apply those.
-        if self.sorter:
-            w = self.sorter.split(word)
-            if self.use_assim:
-                w = sc.apply_assimilations(w)
-            if self.use_coronal_metathesis:
-                w = sc.apply_coronal_metathesis(w)
-            word = "".join(w)
+        if self.sorter and (self.use_assim or self.use_coronal_metathesis):
+            word = self.assimilate(word)
 
         # Now the filters.
-        for (pat, repl) in self.filters:
-            word = re.sub(pat, repl, word)
-            if re.search('REJECT', word, flags=re.UNICODE):
-                return 'REJECT'
-        return word
+        if self.filter_chain is None:
+            self.compile_filters()
+        return self.filter_chain(word)
+
+    # Assimilation and metathesis go letter by letter, as they always
+    # have, and not by the graphs of the sort order: taking "dʒ" as
+    # one sound would change the words existing definitions make.
+    def assimilate(self, word):
+        w = list(word)
+        if self.use_assim:
+            w = sc.apply_assimilations(w)
+        if self.use_coronal_metathesis:
+            w = sc.apply_coronal_metathesis(w)
+        return "".join(w)
 
     def add_sort_order(self, order):
         self.sorter = ArbSorter(order)
+        self.filter_chain = None
+        self.sampler = None
 
     def use_ipa(self):
-        sc.initialize()
+        self.features = 'ipa'
+        sc.initialize(self.features)
+        self.filter_chain = None
+        self.sampler = None
 
     def use_digraphs(self):
-        sc.initialize('digraph')
+        self.features = 'digraph'
+        sc.initialize(self.features)
+        self.filter_chain = None
+        self.sampler = None
+
+    def use_alias_sampling(self):
+        self.selector = AliasSelector
+        for (name, ph) in self.phonemeset.items():
+            self.phonemeset[name] = AliasSelector(dict(zip(ph.keys, ph.weights)))
+        self.recompile_rules()
+        self.rule_selector = None
 
     def with_std_assimilations(self):
         self.use_assim = True
+        self.filter_chain = None
+        self.sampler = None
 
     def with_coronal_metathesis(self):
         self.use_coronal_metathesis = True
-
-    def get_all_possible(self):
-        for key, value in self.ruleset:
-            words = 's'
-
-    def generate(self, n=10, unsorted=False):
-        """Generate n unique words randomly from the rules."""
-        # Need to stop the while loop if there are no more combinations
-        # but n is still less than the list of words.
-        # Also need to change that funky 'REJECT' to something that
-        # is not a string
-        words = set()
-        counter = 0
-        while len(words) < n and counter < n * 3:
-            rule = select(self.ruleset)
-            word = self.apply_filters(self.run_rule(rule))
-            if word != 'REJECT':
-                if word in words:
-                    counter += 1
-                else:
-                    words.add(word)
-                    counter += 1
-
-        words = list(words)
+        self.filter_chain = None
+        self.sampler = None
+
+    def use_constrained_sampling(self):
+        """Never draw a word that a literal rejection would throw out
+        (see constrained.py)."""
+        self.constrained = True
+        self.sampler = None
+
+    def use_uca_sort(self):
+        """Sort word lists by the Unicode Collation Algorithm, rather
+        than by letters: or code point."""
+        self.collator = uca_collator()
+
+    def raw_word_maker(self):
+        """A function that makes one raw word at random each call."""
+        self.check_rules()
+        # With no rejections to avoid, the sampler would only make the
+        # same words more slowly.
+        if self.constrained and self.raw_rejects():
+            if self.sampler is None:
+                from constrained import ConstrainedSampler
+                self.sampler = ConstrainedSampler(self)
+            # With nothing left that can pass, every word gets
+            # rejected either way.
+            if self.sampler.total > 0:
+                if self.stats is not None:
+                    return self.stats.timed(self.stats.run_rule, self.sampler.sample)
+                return self.sampler.sample
+        selector = self.rule_selector or self.build_rule_selector()
+        programs = self.programs
+        if self.stats is not None:
+            return self.stats.raw_word_maker(selector, programs, self.run_program)
+        def make_raw():
+            return self.run_program(programs[selector.select()])
+        return make_raw
+
+    # The literal rejections the filters look for before anything
+    # else changes a word.  Assimilation and metathesis come before
+    # the filters, so raw words are searched as assimilate() will
+    # leave them.
+    def raw_rejects(self):
+        """Literal rejections that can be checked on a raw rule run."""
+        if self.filter_chain is None:
+            self.compile_filters()
+        return self.filter_chain.leading_rejects()
+
+    def raw_reject_automaton(self):
+        """An automaton that finds raw_rejects() in a raw word as it
+        will be after assimilation and metathesis, or None."""
+        patterns = self.raw_rejects()
+        if not patterns:
+            return None
+        automaton = AhoCorasick(patterns)
+        if self.sorter and (self.use_assim or self.use_coronal_metathesis):
+            automaton = AssimilatedAutomaton(
+                automaton,
+                sc.ASSIMILATIONS if self.use_assim else {},
+                sc.METATHESES if self.use_coronal_metathesis else {})
+        return automaton
+
+    def count_possible(self):
+        """How many ways the rules can be run: an upper bound on the
+        number of different words."""
+        if self.ways is None:
+            self.ways = wordspace.count_possible(self)
+        return self.ways
+
+    def iter_all_possible(self):
+        """Yield every different word the rules can make, in order."""
+        return wordspace.iter_possible(self)
+
+    def get_all_possible(self, unsorted=False):
+        """Every different word the rules can make."""
+        words = list(self.iter_all_possible())
         if not unsorted:
-            if self.sorter is not None:
-                words = self.sorter(words)
-            else:
-                words.sort()
+            words = self.sort_words(words)
         return words
 
+    def iter_words(self, limit=None, dedup=None, max_attempts=None):
+        """Yield words one at a time, as they are made.
+
+        Rejected words are skipped, and so are repeats according to
+        dedup (see dedup.py; by default every word is remembered).
+        Stops after limit words, or after max_attempts words that
+        weren't rejected if that is given, or else when the language
+        looks used up (see saturation.StreamTally).  With NoDedup
+        nothing is ever a repeat, so only limit stops it.  In any
+        case it stops if every word is rejected for long enough.
+        """
+        if dedup is None:
+            dedup = ExactDedup()
+        tally = saturation.StreamTally(self.count_possible())
+        if max_attempts is None and not isinstance(dedup, NoDedup):
+            stop = tally.exhausted
+        else:
+            stop = tally.none_pass
+        make_raw = self.raw_word_maker()
+        made = 0
+        attempts = 0
+        while ((limit is None or made < limit)
+               and (max_attempts is None or attempts < max_attempts)):
+            word = self.apply_filters(make_raw())
+            if word == 'REJECT':
+                tally.add(word, False)
+                if stop():
+                    return
+                continue
+            attempts += 1
+            new = dedup.add(word)
+            if new:
+                made += 1
+                yield word
+            tally.add(word, new)
+            if stop():
+                return
+
+    def generate(self, n=10, unsorted=False, workers=None, seed=None):
+        """Generate n unique words randomly from the rules.
+
+        With workers, the words are made by that many processes (see
+        parallel.py), and the same seed and number of workers always
+        give the same words.
+        """
+        if workers:
+            import parallel
+            return parallel.generate(self, n, unsorted, workers, seed)
+        return self.generate_list(n, unsorted, seed).words
+
+    def generate_list(self, n=10, unsorted=False, seed=None):
+        """Generate up to n unique words, stopping early only if the
+        language looks used up.  When n is at least half the number of
+        ways to run the rules, and that isn't too many, every word is
+        listed and n are drawn without replacement instead.
+
+        Returns a saturation.WordList: the words, a WordListCode
+        status, and counts of the repeats and rejects on the way.
+        """
+        if seed is not None:
+            random.seed(seed)
+        ways = self.count_possible()
+        # Asking for much of a small language: list it all and draw
+        # without replacement.
+        if ways <= wordspace.SMALL_LANGUAGE and n * 2 >= ways:
+            chances = wordspace.word_chances(self)
+            result = saturation.drawn(wordspace.sample_words(chances, n), n, len(chances))
+        else:
+            make_raw = self.raw_word_maker()
+            def make_word():
+                return self.apply_filters(make_raw())
+            result = saturation.collect(make_word, n, ways)
+        if self.stats is not None:
+            self.stats.add_tally(result.tally)
+        if not unsorted:
+            result.words = self.sort_words(result.words)
+        return result
+
+    def generate_batch(self, n=10, unsorted=False, seed=None):
+        """Like generate(), but with the numpy batch engine if numpy is
+        there.  BatchEngine.generate_list() gives the status as well."""
+        try:
+            from batch import BatchEngine
+            engine = BatchEngine(self, seed)
+        except ImportError:
+            if seed is not None:
+                random.seed(seed)
+            return self.generate(n, unsorted)
+        return engine.generate(n, unsorted)
+
+    def sort_words(self, words):
+        if self.collator is not None:
+            # Ties (words no different to collation) go by code point.
+            keys = self.collator.sort_keys(words, bytes_keys=True)
+            return [word for (key, word) in sorted(zip(keys, words))]
+        if self.sorter is not None:
+            return self.sorter(words)
+        return sorted(words)
+
+    def iter_sorted(self, words, run_size=None, directory=None):
+        """Like sort_words(), but for words (e.g. from iter_words())
+        too many to hold at once: see extsort.py."""
+        import extsort
+        if run_size is None:
+            run_size = extsort.RUN_SIZE
+        return extsort.sort_words(words, self.sorter, run_size, directory, self.collator)
+
+
+UCA_TABLE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'pyuca', 'allkeys.txt')
+COLLATORS = {}
+
+
+def uca_collator():
+    """The Collator for pyuca's table, loaded the first time it's
+    needed and shared after that."""
+    if UCA_TABLE not in COLLATORS:
+        from pyuca.collator import Collator
+        COLLATORS[UCA_TABLE] = Collator(UCA_TABLE)
+    return COLLATORS[UCA_TABLE]
+
 
 def textify(phsys, sentences=11) -> str:
-    """Generate a fake paragraph of text from a sound system."""
+    """Generate a fake paragraph of text from a sound system.  It is
+    empty if the sound system can't make any words."""
     text = ""
     for i in range(sentences):
         sent = random.randint(3, 11)
@@ -243,14 +600,25 @@ def textify(phsys, sentences=11) -> str:
             comma = random.randint(0, sent - 2)
         else:
             comma = -1
-        text += phsys.generate(1, unsorted=True)[0].capitalize()
+        word = one_word(phsys)
+        if not word:
+            break
+        text += word.capitalize()
         for j in range(sent):
-            text += " " + phsys.generate(1, unsorted=True)[0]
+            word = one_word(phsys)
+            if word:
+                text += " " + word
             if j == comma:
                 text += ","
         if random.randint(0, 100) <= 85:
             text += ". "
         else:
             text += "? "
+    import textwrap
     text = textwrap.wrap(text, 70)
     return "\n".join(text)
+
+
+def one_word(phsys):
+    words = phsys.generate(1, unsorted=True)
+    return words[0] if words else ""
@@ -0,0 +1,166 @@
+"""Counting and listing every word a sound system can make.
+
+Both work from the compiled rules (see SoundSystem.compile_rule()).
+Counts are of the ways a rule can be run, which is an upper bound on
+the number of different words: two runs can spell the same thing,
+and filters can merge or reject words.
+
+When a language is small enough to list, SoundSystem.generate() draws
+from the list without replacement instead of making words at random
+and throwing the repeats away, which near the end is mostly repeats.
+"""
+import heapq
+import math
+import random
+
+import wordgen
+
+# Languages with no more ways to run their rules than this can be
+# listed in full to sample from.
+SMALL_LANGUAGE = 2000000
+
+
+def weighted_keys(arg):
+    # Phonemes that can actually be drawn.
+    selector = arg.__self__
+    return [key for (key, weight) in zip(selector.keys, selector.weights) if weight > 0]
+
+
+def count_program(program):
+    """How many ways a compiled rule can be run."""
+    # Only a '!' cares what came before it, and only about the last
+    # sound, so keep counts per last sound emitted.
+    ways = {None: 1}
+    for (op, arg) in program:
+        total = sum(ways.values())
+        if op == wordgen.LITERAL:
+            ways = {arg: total}
+        elif op == wordgen.OPTIONAL_LITERAL:
+            ways[arg] = ways.get(arg, 0) + total
+        elif op == wordgen.DISTINCT:
+            ways = {key: total - ways.get(key, 0) for key in weighted_keys(arg)}
+        else:
+            new = {key: total for key in weighted_keys(arg)}
+            if op == wordgen.OPTIONAL:
+                for (last, count) in ways.items():
+                    new[last] = new.get(last, 0) + count
+            ways = new
+    return sum(ways.values())
+
+
+def count_possible(ss):
+    """How many ways there are to run all of a sound system's rules."""
+    return sum(count_program(program) for program in ss.programs.values())
+
+
+def weighted_choices(arg):
+    # (phoneme, chance) for everything that can be drawn.
+    selector = arg.__self__
+    return [(key, weight / selector.sum)
+            for (key, weight) in zip(selector.keys, selector.weights) if weight > 0]
+
+
+def program_choices(program):
+    # weighted_choices() for each slot of a compiled rule; a literal
+    # is its own only choice.
+    return [[(arg, 1.0)] if op in (wordgen.LITERAL, wordgen.OPTIONAL_LITERAL) else weighted_choices(arg)
+            for (op, arg) in program]
+
+
+def slot_options(op, choices, last, fill):
+    """What a slot can emit, with chances, after the sound last.  None
+    stands for an optional slot left empty."""
+    if op == wordgen.OPTIONAL or op == wordgen.OPTIONAL_LITERAL:
+        return [(None, 1 - fill)] + [(ph, p * fill) for (ph, p) in choices]
+    if op == wordgen.DISTINCT:
+        # Drawn from the rest of the class, in proportion.
+        rest = 1 - sum(p for (ph, p) in choices if ph == last)
+        return [(ph, p / rest) for (ph, p) in choices if ph != last] if rest > 0 else []
+    return choices
+
+
+def derivations(program, automaton=None, fill=0.5):
+    """Every run of a compiled rule, as (raw word, chance) pairs, in
+    order.  fill is the chance that an optional slot is filled.
+
+    Runs that will contain one of the automaton's patterns are
+    dropped as soon as the pattern turns up, so none of their
+    continuations are ever built.
+    """
+    end = len(program)
+    choices = program_choices(program)
+
+    def walk(i, prefix, last, state, chance):
+        if i == end:
+            yield (prefix, chance)
+            return
+        for (ph, p) in slot_options(program[i][0], choices[i], last, fill):
+            if p <= 0:
+                continue
+            if ph is None:  # optional slot left empty
+                yield from walk(i + 1, prefix, last, state, chance * p)
+                continue
+            nstate = state
+            if automaton is not None:
+                nstate = automaton.advance(state, ph)
+                if nstate is None:
+                    continue
+            yield from walk(i + 1, prefix + ph, ph, nstate, chance * p)
+
+    return walk(0, '', None, 0, 1.0)
+
+
+def iter_program(program, automaton=None):
+    """Every run of a compiled rule, as raw words, in order."""
+    for (raw, chance) in derivations(program, automaton):
+        yield raw
+
+
+def iter_possible(ss):
+    """Every different word the sound system can make, filtered, in
+    the order the rules and classes give them."""
+    automaton = ss.raw_reject_automaton()
+    seen = set()
+    for rule in ss.ruleset:
+        for raw in iter_program(ss.programs[rule], automaton):
+            word = ss.apply_filters(raw)
+            if word != 'REJECT' and word not in seen:
+                seen.add(word)
+                yield word
+
+
+def fill_chance(ss):
+    # random.randint(0, 100) < randpercent, as run_program() does it.
+    return min(max(ss.randpercent, 0), 101) / 101
+
+
+def word_chances(ss):
+    """Every different word the sound system can make, with the chance
+    that a single run of generate()'s loop makes it."""
+    automaton = ss.raw_reject_automaton()
+    fill = fill_chance(ss)
+    total = sum(ss.ruleset.values())
+    chances = {}
+    for (rule, weight) in ss.ruleset.items():
+        if weight <= 0:
+            continue
+        for (raw, chance) in derivations(ss.programs[rule], automaton, fill):
+            word = ss.apply_filters(raw)
+            if word != 'REJECT':
+                chances[word] = chances.get(word, 0.0) + chance * weight / total
+    return chances
+
+
+def sample_words(chances, n):
+    """n different words, drawn without replacement from those in
+    chances (as word_chances() gives them), each in proportion to its
+    chance.
+
+    The words come out as though made by generate() with repeats
+    thrown away, but without making any repeats.  (Each word gets the
+    key log(u) / chance for a uniform u, and the n largest keys win:
+    Efraimidis and Spirakis' method.)
+    """
+    keyed = ((math.log(1.0 - random.random()) / chance, word)
+             for (word, chance) in chances.items() if chance > 0)
+    return [word for (key, word) in heapq.nlargest(n, keyed)]